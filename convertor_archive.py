@@ -0,0 +1,80 @@
+import os
+import tarfile
+import zipfile
+
+# Archive extensions and the tarfile write mode for each tar variant
+TAR_WRITE_MODES = {
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tgz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz',
+}
+ARCHIVE_EXTENSIONS = ('.zip',) + tuple(TAR_WRITE_MODES)
+
+def is_archive(path):
+    """Return whether a path names a zip or tar archive by its extension"""
+    return path is not None and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def archive_base(path):
+    """Return the path of an archive without its archive extension"""
+    for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if path.lower().endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+def is_markdown(name):
+    return name.lower().endswith(('.md', '.markdown'))
+
+def iter_archive_markdown(archive_path):
+    """Yield (member_name, data) for each markdown member of a zip or tar archive
+
+    Members are read one at a time while the archive is being read, without
+    extracting it. Tar archives, compressed or not, are read as a stream.
+    """
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_markdown(info.filename):
+                    with archive.open(info) as member:
+                        yield info.filename, member.read()
+    else:
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for info in archive:
+                if info.isfile() and is_markdown(info.name):
+                    member = archive.extractfile(info)
+                    yield info.name, member.read()
+
+def iter_folder_markdown(folder_path):
+    """Yield (filename, data) for each markdown file in a folder"""
+    for filename in sorted(os.listdir(folder_path)):
+        file_path = os.path.join(folder_path, filename)
+        if is_markdown(filename) and os.path.isfile(file_path):
+            with open(file_path, 'rb') as f:
+                yield filename, f.read()
+
+class ArchiveWriter:
+    """Add converted files to a zip or tar archive, chosen by the archive's extension"""
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        lower = archive_path.lower()
+        if lower.endswith('.zip'):
+            self.archive = zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            mode = next(mode for extension, mode in TAR_WRITE_MODES.items() if lower.endswith(extension))
+            self.archive = tarfile.open(archive_path, mode)
+
+    def add(self, file_path, member_name):
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.write(file_path, member_name)
+        else:
+            self.archive.add(file_path, member_name)
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,49 +1,108 @@
 import os
-import pypandoc
+import time
+import shutil
+import tempfile
+import itertools
+from convertor_engines import get_engine
+from convertor_scheduler import AdaptiveScheduler
+from convertor_preprocess import DEFAULT_PIPELINE, ListFormattingStage, Pipeline
+from convertor_resources import EMBEDDING_FORMATS
+from convertor_input import iter_markdown_chunks, split_lines
+from convertor_archive import ArchiveWriter, archive_base, is_archive, iter_archive_markdown, iter_folder_markdown
+from convertor_split import SPLIT_THRESHOLD_BYTES, convert_split_content
 
-def convert_file(input_path, output_path=None, output_format='docx'):
-    """Convert a markdown file to the specified format using pandoc"""
+# Number of archive entries read ahead and converted together
+ARCHIVE_BATCH_SIZE = 64
+
+def convert_file(input_path, output_path=None, output_format='docx', split_threshold=SPLIT_THRESHOLD_BYTES,
+                 split_workers=None, verify_split=False, engine='pandoc', stats=None, resource_cache=None,
+                 encodings=None):
+    """Convert a markdown file to the specified format
+
+    The engine is 'pandoc' (the default), 'markdown' for the in-process HTML
+    engine, or 'auto' to use the in-process engine whenever it can handle the
+    document.
+
+    When the input is larger than split_threshold bytes (SPLIT_THRESHOLD_BYTES
+    by default, None to never split), the document is split at top-level
+    headings, the chunks are parsed in parallel and the merged AST is rendered
+    once; see convertor_split. With verify_split the merged AST is also checked
+    against an unsplit parse and the unsplit one is used if they differ.
+    
+    The file is decoded using its byte order mark, or else with the first of
+    encodings (by default convertor_input.DEFAULT_ENCODINGS) that can decode it.
+    
+    If a stats dict is given it is filled with the time spent preprocessing,
+    which includes reading and decoding the file, and converting, and with the
+    'cpu_time' and 'max_rss' of the conversion when the engine can measure them.
+    
+    With a ResourceCache as resource_cache, images referenced by the document
+    are resolved through the cache for formats that embed them.
+    """
+    # If no output path is specified, create one based on the input path
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + '.' + output_format
+    
+    # Stream the decoded lines of the file straight into preprocessing, where
+    # read and decoding errors are reported like any conversion error
+    content = iter_markdown_chunks(input_path, encodings)
+    
+    return convert_markdown(content, output_path, output_format, split_threshold, split_workers,
+                            verify_split, engine, stats, resource_cache, os.path.dirname(input_path))
+
+def convert_markdown(content, output_path, output_format='docx', split_threshold=SPLIT_THRESHOLD_BYTES,
+                     split_workers=None, verify_split=False, engine='pandoc', stats=None,
+                     resource_cache=None, base_dir=None):
+    """Convert markdown to the specified format, see convert_file for the options
+
+    content is markdown text or lists of lines as read by iter_markdown_chunks.
+    base_dir is the folder relative image paths are resolved against.
+    """
+    if stats is None:
+        stats = {}
     try:
-        # If no output path is specified, create one based on the input path
-        if output_path is None:
-            output_path = os.path.splitext(input_path)[0] + '.' + output_format
-        
-        # Read and preprocess the markdown content
-        with open(input_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Ensure proper list formatting by adding blank lines before and after lists
-        # and ensuring each list item is properly formatted with spaces
-        content = preprocess_markdown_lists(content)
-            
-        # Write preprocessed content to a temporary file
-        temp_filename = "temp_" + os.path.basename(input_path)
-        with open(temp_filename, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # Run the preprocessing stages, by default the list formatting fixes
+        start = time.perf_counter()
+        content = preprocess_markdown(content, stats.setdefault('preprocess_stages', {}))
+        stats['preprocess_time'] = time.perf_counter() - start
         
-        # Additional pandoc options to better handle lists
-        extra_args = [
-            '--wrap=preserve',      # Preserve line wrapping
-            '--markdown-headings=atx',  # Use # style headings
-        ]
+        # Serve the images the output embeds from the shared resource cache
+        resources = None
+        if resource_cache is not None and output_format in EMBEDDING_FORMATS:
+            content, resources = resource_cache.rewrite(content, base_dir)
         
-        # Convert the file with the additional options
-        pypandoc.convert_file(temp_filename, output_format, outputfile=output_path, extra_args=extra_args)
+        selected = get_engine(engine, output_format, content, resources)
         
-        # Clean up the temporary file
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+        # Huge documents are parsed in parallel chunks instead of by one pandoc process
+        start = time.perf_counter()
+        # Characters take up to four bytes, so most documents skip the encoding
+        if (selected.name == 'pandoc' and split_threshold is not None
+                and len(content) * 4 > split_threshold and len(content.encode('utf-8')) > split_threshold):
+            usage = convert_split_content(content, output_path, output_format, split_workers, verify_split,
+                                          resources)
+        else:
+            usage = selected.convert(content, output_path, output_format, resources)
+        if usage:
+            stats.update(usage)
+        stats['convert_time'] = time.perf_counter() - start
             
         return True, output_path
     except Exception as e:
-        # Clean up in case of error
-        temp_filename = "temp_" + os.path.basename(input_path)
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
         return False, str(e)
 
-def convert_folder(input_folder, output_folder=None, output_format='docx'):
-    """Convert all markdown files in a folder to the specified format"""
+def convert_folder(input_folder, output_folder=None, output_format='docx', engine='pandoc',
+                   min_workers=1, max_workers=None, memory_budget=None, profiler=None, resource_cache=None,
+                   encodings=None):
+    """Convert all markdown files in a folder to the specified format
+
+    The input may also be a .zip or .tar(.gz) archive, and the output may be an
+    archive to write all converted files into; see convert_archive.
+    """
+    if is_archive(input_folder) or is_archive(output_folder):
+        return convert_archive(input_folder, output_folder, output_format, engine, min_workers,
+                               max_workers, memory_budget, profiler=profiler, resource_cache=resource_cache,
+                               encodings=encodings)
+    
     # If no output folder is specified, use the input folder
     if output_folder is None:
         output_folder = input_folder
@@ -52,119 +111,252 @@ def convert_folder(input_folder, output_folder=None, output_format='docx'):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     
-    # Initialize counters
-    success_count = 0
-    error_count = 0
-    error_files = []
-    
-    # Process each markdown file in the input folder
+    # Collect each markdown file in the input folder
+    file_pairs = []
     for filename in os.listdir(input_folder):
         if filename.lower().endswith(('.md', '.markdown')):
             input_path = os.path.join(input_folder, filename)
             output_filename = os.path.splitext(filename)[0] + '.' + output_format
             output_path = os.path.join(output_folder, output_filename)
+            file_pairs.append((input_path, output_path))
+    
+    return convert_files(file_pairs, output_format, engine, min_workers, max_workers, memory_budget, profiler,
+                         resource_cache, encodings)
+
+def unique_output_path(path, used):
+    """Return path, numbered before its extension if another output of the run already uses it
+
+    used is the set of paths taken so far in the run; the returned path is added to it.
+    """
+    base, extension = os.path.splitext(path)
+    candidate = path
+    number = 0
+    while os.path.normcase(os.path.abspath(candidate)) in used:
+        number += 1
+        candidate = f"{base}-{number}{extension}"
+    used.add(os.path.normcase(os.path.abspath(candidate)))
+    return candidate
+
+def convert_files(file_pairs, output_format='docx', engine='pandoc', min_workers=1, max_workers=None,
+                  memory_budget=None, profiler=None, resource_cache=None, encodings=None):
+    """Convert (input_path, output_path) pairs concurrently with the adaptive scheduler
+
+    An output_path of None places the output next to the input. Inputs that
+    would be written to the same output, such as notes.md and notes.markdown or
+    files of the same name from different folders, get numbered outputs
+    (notes-1.html) so parallel conversions never write one file. The number of
+    conversions running at once adapts to their measured CPU use between
+    min_workers and max_workers, and to memory_budget (bytes, half of the
+    physical memory by default). A ConversionProfiler given as profiler
+    records every conversion, and a ResourceCache as resource_cache is shared
+    by all of them.
+    """
+    def make_job(input_path, output_path):
+        def job(stats):
+            if profiler is not None:
+                return profiler.run(input_path, convert_file, input_path, output_path, output_format,
+                                    engine=engine, stats=stats, resource_cache=resource_cache,
+                                    encodings=encodings)
+            return convert_file(input_path, output_path, output_format, engine=engine, stats=stats,
+                                resource_cache=resource_cache, encodings=encodings)
+        return os.path.getsize(input_path), job
+    
+    # Initialize counters
+    success_count = 0
+    error_count = 0
+    error_files = []
+    
+    jobs = []
+    job_inputs = []
+    used_outputs = set()
+    for input_path, output_path in file_pairs:
+        if output_path is None:
+            output_path = os.path.splitext(input_path)[0] + '.' + output_format
+        output_path = unique_output_path(output_path, used_outputs)
+        try:
+            jobs.append(make_job(input_path, output_path))
+            job_inputs.append(input_path)
+        except OSError as e:
+            error_count += 1
+            error_files.append((os.path.basename(input_path), str(e)))
+    
+    scheduler = AdaptiveScheduler(min_workers, max_workers, memory_budget)
+    for input_path, (success, result) in zip(job_inputs, scheduler.run(jobs)):
+        if success:
+            success_count += 1
+        else:
+            error_count += 1
+            error_files.append((os.path.basename(input_path), result))
+    
+    return success_count, error_count, error_files
+
+def convert_archive(input_path, output_path=None, output_format='docx', engine='pandoc', min_workers=1,
+                    max_workers=None, memory_budget=None, batch_size=ARCHIVE_BATCH_SIZE, profiler=None,
+                    resource_cache=None, encodings=None):
+    """Convert markdown from a folder or archive into a folder or archive without extracting
+
+    Entries are read from the input as a stream and converted in batches of
+    batch_size, so neither archive is ever held in memory as a whole. When the
+    output is an archive each converted file is added to it as soon as its batch
+    finishes. Without an output path the outputs go to a folder named after the
+    input archive. Entries with the same output name get numbered outputs, as in
+    convert_files. Images are resolved through resource_cache as in
+    convert_file, relative to the entry for a folder input and to the current
+    directory for an archive, whose members cannot be read as files.
+    """
+    if output_path is None:
+        output_path = archive_base(input_path) if is_archive(input_path) else input_path
+    
+    if is_archive(input_path):
+        entries = iter_archive_markdown(input_path)
+    else:
+        entries = iter_folder_markdown(input_path)
+    
+    # Outputs bound for an archive are written to a scratch folder first
+    writer = None
+    temp_folder = None
+    if is_archive(output_path):
+        output_parent = os.path.dirname(os.path.abspath(output_path))
+        if not os.path.exists(output_parent):
+            os.makedirs(output_parent)
+        writer = ArchiveWriter(output_path)
+        temp_folder = tempfile.mkdtemp(prefix='temp_')
+    elif not os.path.exists(output_path):
+        os.makedirs(output_path)
+    
+    base_folder = None if is_archive(input_path) else input_path
+    
+    def make_job(name, data, target):
+        base_dir = os.path.join(base_folder, os.path.dirname(name)) if base_folder is not None else None
+        
+        def job(stats):
+            # Decoding errors surface as a failed conversion of this entry
+            content = split_lines(data, encodings)
+            if profiler is not None:
+                return profiler.run(name, convert_markdown, content, target, output_format,
+                                    engine=engine, stats=stats, resource_cache=resource_cache,
+                                    base_dir=base_dir)
+            return convert_markdown(content, target, output_format, engine=engine, stats=stats,
+                                    resource_cache=resource_cache, base_dir=base_dir)
+        return len(data), job
+    
+    # Initialize counters
+    success_count = 0
+    error_count = 0
+    error_files = []
+    
+    scheduler = AdaptiveScheduler(min_workers, max_workers, memory_budget)
+    used_outputs = set()
+    try:
+        while True:
+            batch = list(itertools.islice(entries, batch_size))
+            if not batch:
+                break
             
-            success, result = convert_file(input_path, output_path, output_format)
-            if success:
-                success_count += 1
-            else:
-                error_count += 1
-                error_files.append((filename, result))
+            jobs = []
+            targets = []
+            for i, (name, data) in enumerate(batch):
+                output_name = os.path.splitext(name)[0] + '.' + output_format
+                # Never write outside the output folder, whatever the member name
+                if os.path.isabs(output_name) or '..' in output_name.replace('\\', '/').split('/'):
+                    error_count += 1
+                    error_files.append((name, "Unsafe path in archive"))
+                    continue
+                output_name = unique_output_path(output_name, used_outputs)
+                
+                if writer is not None:
+                    target = os.path.join(temp_folder, f"{i}.{output_format}")
+                else:
+                    target = os.path.join(output_path, output_name)
+                    target_folder = os.path.dirname(target)
+                    if not os.path.exists(target_folder):
+                        os.makedirs(target_folder)
+                jobs.append(make_job(name, data, target))
+                targets.append((name, output_name, target))
+            del batch
+            
+            for (name, output_name, target), (success, result) in zip(targets, scheduler.run(jobs)):
+                if success:
+                    success_count += 1
+                    if writer is not None:
+                        writer.add(target, output_name)
+                        os.remove(target)
+                else:
+                    error_count += 1
+                    error_files.append((name, result))
+    finally:
+        if writer is not None:
+            writer.close()
+            shutil.rmtree(temp_folder, ignore_errors=True)
     
     return success_count, error_count, error_files
 
-def combine_files(input_files, output_path, output_format='docx'):
-    """Combine multiple markdown files into a single document"""
+def combine_files(input_files, output_path, output_format='docx', engine='pandoc', stats=None,
+                  resource_cache=None, encodings=None):
+    """Combine multiple markdown files into a single document
+
+    If a stats dict is given it is filled in the same way as by convert_file,
+    and files are decoded and images resolved through resource_cache as they
+    are there.
+    """
+    if stats is None:
+        stats = {'preprocess_time': 0.0}
+    else:
+        stats.update(preprocess_time=0.0)
     try:
         # Create a temporary file with all content combined
         combined_content = ""
         file_headers = []
+        resources = None
         
         for i, file_path in enumerate(input_files):
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                
-                # Preprocess the content to fix list formatting
-                content = preprocess_markdown_lists(content)
-                
-                # Add a page break between files except for the first one
-                if i > 0:
-                    combined_content += "\n\n\\pagebreak\n\n"
-                
-                # Extract filename without extension for a header
-                filename = os.path.basename(file_path)
-                file_base = os.path.splitext(filename)[0]
-                file_headers.append(file_base)
-                
-                # Add a header for each file
-                combined_content += f"# {file_base}\n\n"
-                combined_content += content
-        
-        # Create a temporary file
-        temp_file = "combined_temp.md"
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write(combined_content)
-        
-        # Additional pandoc options to better handle lists
-        extra_args = [
-            '--wrap=preserve',      # Preserve line wrapping
-            '--markdown-headings=atx',  # Use # style headings
-        ]
-        
-        # Convert the combined file with additional options
-        pypandoc.convert_file(temp_file, output_format, outputfile=output_path, extra_args=extra_args)
+            # Read, decode and preprocess the content to fix list formatting
+            start = time.perf_counter()
+            content = preprocess_markdown(iter_markdown_chunks(file_path, encodings),
+                                          stats.setdefault('preprocess_stages', {}))
+            stats['preprocess_time'] += time.perf_counter() - start
+            
+            # Shared images across the combined files are resolved once through the cache
+            if resource_cache is not None and output_format in EMBEDDING_FORMATS:
+                content, resources = resource_cache.rewrite(content, os.path.dirname(file_path), resources)
+            
+            # Add a page break between files except for the first one
+            if i > 0:
+                combined_content += "\n\n\\pagebreak\n\n"
+            
+            # Extract filename without extension for a header
+            filename = os.path.basename(file_path)
+            file_base = os.path.splitext(filename)[0]
+            file_headers.append(file_base)
+            
+            # Add a header for each file
+            combined_content += f"# {file_base}\n\n"
+            combined_content += content
         
-        # Clean up the temporary file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        # Convert the combined content with the selected engine
+        selected = get_engine(engine, output_format, combined_content, resources)
+        start = time.perf_counter()
+        usage = selected.convert(combined_content, output_path, output_format, resources)
+        if usage:
+            stats.update(usage)
+        stats['convert_time'] = time.perf_counter() - start
         
         return True, output_path
     except Exception as e:
-        # Clean up in case of error
-        if os.path.exists("combined_temp.md"):
-            os.remove("combined_temp.md")
         return False, str(e)
 
+def preprocess_markdown(content, timings=None):
+    """Run the stages registered on the default preprocessing pipeline over markdown content
+
+    content is markdown text or lists of lines as read by iter_markdown_chunks.
+    If a timings dict is given the seconds spent in each stage are added to it.
+    """
+    if isinstance(content, str):
+        return DEFAULT_PIPELINE.run_text(content, timings)
+    return '\n'.join(DEFAULT_PIPELINE.run_chunks(content, timings))
+
 def preprocess_markdown_lists(content):
     """Preprocess markdown content to ensure proper list formatting"""
-    lines = content.split('\n')
-    result = []
-    in_list = False
-    
-    for i, line in enumerate(lines):
-        # Check if this line is a list item
-        is_list_item = line.strip().startswith(('-', '*', '+')) or (line.strip() and line.strip()[0].isdigit() and '.' in line.strip()[:3])
-        
-        # If entering a list
-        if is_list_item and not in_list:
-            in_list = True
-            # Ensure there's a blank line before the list if not at the beginning
-            if i > 0 and result and result[-1].strip():
-                result.append('')
-        
-        # If exiting a list
-        elif not is_list_item and in_list and line.strip():
-            in_list = False
-            # Ensure there's a blank line after the list
-            if result and result[-1].strip():
-                result.append('')
-        
-        # Process list items to ensure proper formatting
-        if is_list_item:
-            # For bullet lists, ensure proper spacing
-            if line.strip().startswith(('-', '*', '+')):
-                marker = line.strip()[0]
-                text = line.strip()[1:].strip()
-                # Ensure the list item has a space after the marker
-                line = f"{marker} {text}"
-            # For numbered lists, ensure proper spacing
-            elif line.strip() and line.strip()[0].isdigit() and '.' in line.strip()[:3]:
-                parts = line.strip().split('.', 1)
-                number = parts[0]
-                text = parts[1].strip()
-                # Ensure the list item has a space after the marker
-                line = f"{number}. {text}"
-        
-        result.append(line)
-    
-    return '\n'.join(result)
\ No newline at end of file
+    pipeline = Pipeline()
+    pipeline.add_stage('lists', ListFormattingStage)
+    return pipeline.run_text(content)
\ No newline at end of file
@@ -0,0 +1,505 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import base64
+import socket
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import pypandoc
+
+# The in-process engine is optional and only used when the package is installed
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+# Additional pandoc options to better handle lists
+PANDOC_EXTRA_ARGS = [
+    '--wrap=preserve',      # Preserve line wrapping
+    '--markdown-headings=atx',  # Use # style headings
+]
+
+# Pandoc-only syntax the in-process engine cannot render the same way
+UNSUPPORTED_MARKDOWN = re.compile(
+    r'^\s*:::'                  # fenced divs
+    r'|^\s*\+[-=+:]+\+\s*$'     # grid tables
+    r'|\{[#.][^}]*\}'           # attribute blocks
+    r'|(?<!\\)\$[^$\s]'         # TeX math
+    r'|\A---\s*$'               # YAML metadata block
+    r'|\[@'                     # citations
+    r'|^\s*\^\['                # inline notes
+    r'|\[\^'                    # footnotes
+    r'|!\['                     # images and figures
+    r'|^[ \t]*(?:`{3,}|~{3,})[ \t]*[^`~\s]|^[ \t]+(?:`{3,}|~{3,})'  # fenced code with a language or in a list
+    r'|^ {0,3}<(?!!--)[A-Za-z]'  # HTML blocks, whose content pandoc parses as markdown
+    r'|<[A-Za-z][A-Za-z0-9+.-]*:[^\s>]*>|<[^\s>@]+@[^\s>]+>'  # autolinks
+    r'|~~|~[^~\s]+~|\^[^^\s]+\^'  # strikeout, subscript and superscript
+    r'|^[ \t]*[-*+][ \t]+\[[ xX]\]'  # task lists
+    r'|^ {0,3}[:~][ \t]'        # definition lists
+    r'|^\*\['                   # abbreviations
+    r'|^#{1,6}[^#\s]'           # headings need a space after the hashes in pandoc
+    r'|^(?![ \t]*#)[^\n]*\S[^\n]*\n {0,3}#{1,6}(?:[ \t]|$)'  # headings without a blank line before them
+    r'|^[ \t]*(?:[A-Za-z]|[ivxlcdmIVXLCDM]+|#)[.)][ \t]|^[ \t]*\(?\d+\)[ \t]'  # fancy list markers
+    r'|^\|[ \t][^|\n]*$'        # line blocks
+    r'|&(?!amp;|lt;|gt;)#?[A-Za-z0-9]+;'  # entities, which pandoc writes as characters
+    r'|\\$'                     # backslash line breaks
+    r'|\]\([^)\s]*\s+["\'(]|^ {0,3}\[[^\]]+\]:\s*\S+\s+["\'(]'  # link titles
+    r"|(?:^|\s)'(?:\d|n')"      # apostrophes pandoc reads as opening quotes
+    r'|\.{4}'                   # dots pandoc does not turn into an ellipsis
+    r'|^[ \t]*\n {1,3}(?![-*+][ \t]|\d+[.)][ \t])\S'  # list item paragraphs indented less than 4 spaces
+    r'|^[ \t]*\n(?: {4}|\t)(?: {4}|\t)'  # code blocks in list items
+    r'|^ {0,3}>[^\n]*\n[ \t]*\n {0,3}>',  # block quotes separated by a blank line
+    re.MULTILINE
+)
+
+# List item markers, which the preprocessing leaves at the start of the line
+LIST_MARKER = re.compile(r' {0,3}(?:[-*+]|\d+[.)])(?:[ \t]|$)')
+HORIZONTAL_RULE = re.compile(r' {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$')
+
+# Typographic characters written by pandoc's smart extension
+SMART_SUBSTITUTIONS = {
+    'mdash': '\u2014',
+    'ndash': '\u2013',
+    'ellipsis': '\u2026',
+    'left-single-quote': '\u2018',
+    'right-single-quote': '\u2019',
+    'left-double-quote': '\u201c',
+    'right-double-quote': '\u201d',
+}
+
+# Images referenced by a local path, which the pandoc server cannot read
+LOCAL_IMAGE = re.compile(r'!\[[^\]]*\]\((?!https?://|data:)|<img\s[^>]*src="(?!https?://|data:)')
+
+# Seconds to wait for a pandoc server to start and to answer one conversion
+SERVER_START_TIMEOUT = 10
+SERVER_REQUEST_TIMEOUT = 300
+
+def run_pandoc(input_path, output_path, output_format, extra_args=(), input_format='markdown'):
+    """Run pandoc on a file and return the resource usage of the pandoc process
+
+    Returns a dict with 'cpu_time', 'user_time', 'sys_time' and the wall clock
+    'pandoc_time' in seconds, and 'max_rss' in bytes. Platforms without
+    os.wait4 go through pypandoc and return None instead.
+    """
+    if not hasattr(os, 'wait4'):
+        pypandoc.convert_file(input_path, output_format, format=input_format, outputfile=output_path,
+                              extra_args=PANDOC_EXTRA_ARGS + list(extra_args))
+        return None
+
+    # Pandoc writes PDF through its LaTeX writer
+    writer = 'latex' if output_format == 'pdf' else output_format
+    args = [pypandoc.get_pandoc_path(), f'--from={input_format}', f'--to={writer}',
+            f'--output={output_path}'] + PANDOC_EXTRA_ARGS + list(extra_args) + [input_path]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    errors = process.stderr.read()
+    process.stderr.close()
+
+    # Reap the process ourselves so its resource usage is not lost
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Pandoc died with exitcode \"{process.returncode}\" during conversion: "
+                           f"{errors.decode('utf-8', 'replace').strip()}")
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    max_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return {
+        'cpu_time': usage.ru_utime + usage.ru_stime,
+        'user_time': usage.ru_utime,
+        'sys_time': usage.ru_stime,
+        'max_rss': max_rss,
+        'pandoc_time': wall_time,
+    }
+
+def pandoc_identifier(text):
+    """Return pandoc's automatic identifier for a heading's plain text, before making it unique"""
+    text = ''.join(ch for ch in text.lower() if ch.isalnum() or ch.isspace() or ch in '_-.')
+    text = '-'.join(text.split())
+    # Identifiers start with a letter
+    for i, ch in enumerate(text):
+        if ch.isalpha():
+            return text[i:]
+    return ''
+
+def pandoc_slugify():
+    """Return a slugify function for Python-Markdown's toc extension giving pandoc's identifiers
+
+    Duplicates are numbered the way pandoc does, so a new function is needed
+    for every document.
+    """
+    used = set()
+
+    def slugify(value, separator):
+        base = pandoc_identifier(value) or 'section'
+        identifier = base
+        number = 0
+        while identifier in used:
+            number += 1
+            identifier = f"{base}-{number}"
+        used.add(identifier)
+        return identifier
+
+    return slugify
+
+def mixed_list_spacing(content):
+    """Return whether a list has both items separated by blank lines and items that are not
+
+    Pandoc makes such a list loose as a whole, putting every item in a
+    paragraph, while Python-Markdown decides for each item.
+    """
+    in_list = False
+    blank = False
+    spacing = set()
+    for line in content.split('\n'):
+        if not line.strip():
+            blank = True
+            continue
+        if LIST_MARKER.match(line) and not HORIZONTAL_RULE.match(line):
+            if in_list:
+                spacing.add(blank)
+            in_list = True
+        elif line[:1] in (' ', '\t'):
+            # Blocks of an item separated by blank lines also make the list loose
+            if in_list and blank:
+                spacing.add(True)
+        elif blank or HORIZONTAL_RULE.match(line):
+            # A paragraph after a blank line or a rule ends the list
+            if len(spacing) > 1:
+                return True
+            in_list = False
+            spacing = set()
+        blank = False
+    return len(spacing) > 1
+
+class PandocEngine:
+    """Convert markdown by running pandoc"""
+    name = 'pandoc'
+
+    def supports(self, output_format, content=None, resources=None):
+        return True
+
+    def convert(self, content, output_path, output_format, resources=None):
+        # Cached images are referenced by name relative to the cache folder
+        extra_args = [f'--resource-path=.{os.pathsep}{resources.directory}'] if resources else []
+        
+        # Write preprocessed content to a uniquely named temporary file so
+        # concurrent conversions never share one
+        fd, temp_filename = tempfile.mkstemp(prefix='temp_', suffix='.md', dir='.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        try:
+            return run_pandoc(temp_filename, output_path, output_format, extra_args)
+        finally:
+            # Clean up the temporary file
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+class MarkdownEngine:
+    """Convert markdown to HTML in-process without starting pandoc"""
+    name = 'markdown'
+    extensions = ['extra', 'sane_lists']
+
+    def available(self):
+        return markdown is not None
+
+    def supports(self, output_format, content=None, resources=None):
+        if not self.available() or output_format != 'html':
+            return False
+        return content is None or not (UNSUPPORTED_MARKDOWN.search(content) or mixed_list_spacing(content))
+
+    def convert(self, content, output_path, output_format, resources=None):
+        start = time.thread_time()
+        
+        # Page breaks are raw TeX, which pandoc drops from HTML output as well
+        content = '\n'.join(line for line in content.split('\n') if line.strip() != '\\pagebreak')
+        # Typographic quotes and dashes and heading identifiers as pandoc writes them
+        html = markdown.markdown(content, extensions=self.extensions + ['smarty', 'toc'], extension_configs={
+            'smarty': {'substitutions': SMART_SUBSTITUTIONS},
+            'toc': {'marker': '', 'slugify': pandoc_slugify()},
+        })
+        # Pandoc marks the numbering style of ordered lists and ends code blocks without a newline
+        html = re.sub(r'<ol( start="\d+")?>', r'<ol\1 type="1">', html)
+        html = html.replace('\n</code></pre>', '</code></pre>')
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(html + '\n')
+        return {'cpu_time': time.thread_time() - start, 'max_rss': None}
+
+class PandocServer:
+    """One local pandoc server process listening on a loopback port"""
+    def __init__(self):
+        # Let the OS pick a free port for the server to bind
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.url = f'http://127.0.0.1:{self.port}/'
+        self.process = subprocess.Popen(
+            [pypandoc.get_pandoc_path(), 'server', f'--port={self.port}',
+             f'--timeout={SERVER_REQUEST_TIMEOUT}'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Wait until the server answers before handing it out
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError("pandoc server exited during start-up")
+            try:
+                with urllib.request.urlopen(self.url + 'version', timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("pandoc server did not start in time")
+                time.sleep(0.05)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def convert(self, content, output_format, files=None):
+        """Convert markdown text and return the output as bytes
+
+        files maps the names of files the document refers to, such as images,
+        to their base64 encoded content.
+        """
+        payload = {
+            'text': content,
+            'from': 'markdown',
+            'to': output_format,
+            'wrap': 'preserve',
+            'markdown-headings': 'atx',
+        }
+        if files:
+            payload['files'] = files
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json',
+                                                  'Accept': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=SERVER_REQUEST_TIMEOUT) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # Conversion errors come back as an error status with pandoc's message
+            raise RuntimeError(f"Pandoc server error: {e.read().decode('utf-8', 'replace').strip()}")
+
+        if result.get('base64'):
+            return base64.b64decode(result['output'])
+        return result['output'].encode('utf-8')
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class PandocServerEngine:
+    """Convert markdown through a pool of persistent local pandoc server processes
+
+    Servers are started on first use, up to pool_size of them, and reused for
+    every following conversion instead of starting pandoc per file. A server
+    that has crashed is replaced and the conversion retried once. The server
+    cannot write PDF or read local files, so PDF output and documents with
+    local images that are not served from a resource cache are converted by
+    the subprocess engine instead.
+    """
+    name = 'server'
+
+    def __init__(self, pool_size=None):
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self.idle = queue.LifoQueue()
+        self.started = 0
+        self.lock = threading.Lock()
+        self.unavailable = False
+
+    def available(self):
+        if self.unavailable:
+            return False
+        try:
+            version = pypandoc.get_pandoc_version()
+        except OSError:
+            version = '0'
+        # The server mode ships with pandoc 3
+        if int(version.split('.')[0]) < 3:
+            self.unavailable = True
+        return not self.unavailable
+
+    def supports(self, output_format, content=None, resources=None):
+        if output_format == 'pdf' or not self.available():
+            return False
+        # Only HTML can refer to images without the server having to read them,
+        # other formats need them sent along from the resource cache
+        return (content is None or output_format == 'html' or resources is not None
+                or not LOCAL_IMAGE.search(content))
+
+    def acquire(self):
+        """Take an idle server from the pool, starting a new one if the pool has room"""
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                start_new = self.started < self.pool_size
+                if start_new:
+                    self.started += 1
+            if start_new:
+                break
+            # Wait for a busy server, rechecking in case one has died meanwhile
+            try:
+                return self.idle.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        try:
+            return PandocServer()
+        except (OSError, RuntimeError):
+            with self.lock:
+                self.started -= 1
+                self.unavailable = True
+            raise
+
+    def release(self, server):
+        if server.alive():
+            self.idle.put(server)
+        else:
+            with self.lock:
+                self.started -= 1
+
+    def shutdown(self):
+        """Stop all idle servers"""
+        while True:
+            try:
+                server = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            server.stop()
+            with self.lock:
+                self.started -= 1
+
+    def convert(self, content, output_path, output_format, resources=None):
+        start = time.perf_counter()
+        files = {name: resources.encoded(name) for name in resources.names} if resources else None
+        for attempt in range(2):
+            try:
+                server = self.acquire()
+            except (OSError, RuntimeError):
+                # The server mode cannot be started here, use the subprocess path
+                # and say so, so its timings are not taken for the server's
+                usage = ENGINES['pandoc'].convert(content, output_path, output_format, resources)
+                return dict(usage or {}, engine='pandoc')
+            try:
+                output = server.convert(content, output_format, files)
+                break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                # The server crashed or hung, replace it and try once more
+                server.stop()
+                if attempt:
+                    raise
+            finally:
+                self.release(server)
+
+        with open(output_path, 'wb') as f:
+            f.write(output)
+        return {'pandoc_time': time.perf_counter() - start}
+
+ENGINES = {
+    'pandoc': PandocEngine(),
+    'markdown': MarkdownEngine(),
+    'server': PandocServerEngine(),
+}
+
+# Stop the pandoc servers when the application exits
+atexit.register(ENGINES['server'].shutdown)
+
+def get_engine(name, output_format, content=None, resources=None):
+    """Return the engine to use for a conversion
+
+    'auto' picks the in-process engine when it can handle the format and content
+    and falls back to pandoc otherwise. 'server' falls back to the pandoc
+    subprocess engine when the server mode cannot handle the conversion. Any
+    other value selects an engine by name.
+    """
+    if name == 'auto':
+        fast = ENGINES['markdown']
+        return fast if fast.supports(output_format, content, resources) else ENGINES['pandoc']
+
+    if name == 'server' and not ENGINES['server'].supports(output_format, content, resources):
+        return ENGINES['pandoc']
+
+    if name not in ENGINES:
+        raise ValueError(f"Unknown conversion engine: {name}")
+    engine = ENGINES[name]
+    if not engine.supports(output_format, content, resources):
+        raise ValueError(f"Engine '{name}' cannot convert this document to {output_format}")
+    return engine
+
+def normalize_html(html):
+    """Normalize the whitespace in HTML so output from different engines can be compared"""
+    html = re.sub(r'>\s+<', '><', html)
+    return re.sub(r'\s+', ' ', html).strip()
+
+def compare_engines(input_paths, output_folder, engine_names=('pandoc', 'markdown')):
+    """Convert files to HTML with two engines, returning parity and timing results
+
+    Returns a list of (filename, identical, timings, skipped) tuples, where
+    timings maps each engine name to the seconds one conversion of that file
+    took and skipped maps the engines that did not convert the file to the
+    reason: not available, not supporting the file (such as the in-process
+    engine for documents using pandoc-only syntax), or handing it to another
+    engine, as the server engine does when no server can be started. identical
+    compares the engines that converted the file and is None when fewer than
+    two did. Each engine converts its first file once untimed beforehand, so
+    start-up costs such as launching pandoc servers are not counted.
+    """
+    from convertor_core import preprocess_markdown
+    from convertor_input import read_markdown
+
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    warmed_up = set()
+    results = []
+    for input_path in input_paths:
+        content = preprocess_markdown(read_markdown(input_path))
+
+        filename = os.path.basename(input_path)
+        base = os.path.splitext(filename)[0]
+        outputs = {}
+        timings = {}
+        skipped = {}
+        for name in engine_names:
+            engine = ENGINES[name]
+            if hasattr(engine, 'available') and not engine.available():
+                skipped[name] = "not available"
+                continue
+            if not engine.supports('html', content):
+                skipped[name] = "not supported"
+                continue
+            output_path = os.path.join(output_folder, f"{base}.{name}.html")
+            if name not in warmed_up:
+                engine.convert(content, output_path, 'html')
+                warmed_up.add(name)
+            start = time.perf_counter()
+            usage = engine.convert(content, output_path, 'html')
+            elapsed = time.perf_counter() - start
+            fallback = (usage or {}).get('engine', name)
+            if fallback != name:
+                skipped[name] = f"fell back to {fallback}"
+                continue
+            timings[name] = elapsed
+            with open(output_path, 'r', encoding='utf-8') as f:
+                outputs[name] = normalize_html(f.read())
+
+        identical = len(set(outputs.values())) == 1 if len(outputs) > 1 else None
+        results.append((filename, identical, timings, skipped))
+
+    return results
@@ -2,7 +2,194 @@ import os
 import platform
 from tkinter import filedialog, Button, Label, StringVar, Entry, messagebox, Listbox, Scrollbar, Frame, ttk, IntVar, Checkbutton
 from tkinter.font import Font
-from convertor_core import convert_file, convert_folder, combine_files
+from convertor_core import convert_file, convert_folder, convert_files, combine_files
+
+# Number of directory entries visited per GUI update while scanning a folder
+FOLDER_SCAN_BATCH = 500
+
+class FileList:
+    """Ordered file paths with constant time membership and logarithmic time indexing, removal and moves
+
+    Removed entries leave a hole in the list of slots. A Fenwick tree counts
+    the entries left in the slots, so an index is found by a tree descent
+    instead of compacting after every removal; the holes are compacted once
+    they make up half of the slots.
+    """
+    def __init__(self):
+        self._items = []      # Paths in display order, None for removed entries
+        self._positions = {}  # Path -> slot in self._items
+        self._counts = [0]    # Fenwick tree of entries per slot, 1-based
+        self._holes = 0
+    
+    def __len__(self):
+        return len(self._positions)
+    
+    def __contains__(self, path):
+        return path in self._positions
+    
+    def __iter__(self):
+        return (path for path in self._items if path is not None)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("file list index out of range")
+        return self._items[self._slot(index)]
+    
+    def index(self, path):
+        """Return the position of a path in the list"""
+        return self._prefix(self._positions[path])
+    
+    def add(self, path):
+        """Append a path unless it is already in the list, returning whether it was added"""
+        if path in self._positions:
+            return False
+        self._positions[path] = len(self._items)
+        self._items.append(path)
+        # The new tree node covers its own slot and the slots below it in its range
+        node = len(self._items)
+        self._counts.append(1 + self._prefix(node - 1) - self._prefix(node - (node & -node)))
+        return True
+    
+    def remove(self, path):
+        """Remove a path from the list"""
+        slot = self._positions.pop(path)
+        self._items[slot] = None
+        node = slot + 1
+        while node < len(self._counts):
+            self._counts[node] -= 1
+            node += node & -node
+        self._holes += 1
+        if self._holes * 2 > len(self._items):
+            self._compact()
+    
+    def move(self, path, offset):
+        """Swap a path with its neighbour offset positions away, returning its new index"""
+        position = self.index(path)
+        target = position + offset
+        if 0 <= target < len(self):
+            slot, other_slot = self._positions[path], self._slot(target)
+            other = self._items[other_slot]
+            self._items[slot], self._items[other_slot] = other, path
+            self._positions[path], self._positions[other] = other_slot, slot
+            return target
+        return position
+    
+    def clear(self):
+        self._items = []
+        self._positions = {}
+        self._counts = [0]
+        self._holes = 0
+    
+    def _prefix(self, slots):
+        """Return the number of entries in the first slots slots"""
+        total = 0
+        while slots > 0:
+            total += self._counts[slots]
+            slots -= slots & -slots
+        return total
+    
+    def _slot(self, index):
+        """Return the slot holding the entry at an index"""
+        slot = 0
+        remaining = index + 1
+        step = 1 << (len(self._items).bit_length() - 1) if self._items else 0
+        while step:
+            if slot + step <= len(self._items) and self._counts[slot + step] < remaining:
+                slot += step
+                remaining -= self._counts[slot]
+            step >>= 1
+        return slot
+    
+    def _compact(self):
+        self._items = [path for path in self._items if path is not None]
+        self._positions = {path: i for i, path in enumerate(self._items)}
+        self._counts = [0] + [1] * len(self._items)
+        for node in range(1, len(self._counts)):
+            parent = node + (node & -node)
+            if parent < len(self._counts):
+                self._counts[parent] += self._counts[node]
+        self._holes = 0
+
+class VirtualListbox:
+    """Listbox that only holds the rows currently visible on screen
+
+    The rows are rendered from a sequence on demand, so the widget stays fast
+    however many entries the sequence holds.
+    """
+    def __init__(self, parent, items, render, scrollbar, **options):
+        self.items = items
+        self.render = render
+        self.scrollbar = scrollbar
+        self.offset = 0
+        self.rows = options.get("height", 10)
+        self.selected = None
+        
+        self.listbox = Listbox(parent, exportselection=False, **options)
+        self.listbox.bind("<Configure>", self._on_resize)
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_mousewheel)
+        self.listbox.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll(3))
+        scrollbar.config(command=self.yview)
+    
+    def pack(self, **options):
+        self.listbox.pack(**options)
+    
+    def selection(self):
+        """Return the index of the selected entry, or None"""
+        return self.selected
+    
+    def select(self, index):
+        self.selected = index
+        if index is not None and not self.offset <= index < self.offset + self.rows:
+            self.offset = max(0, index - self.rows // 2)
+        self.refresh()
+    
+    def yview(self, action, value, unit=None):
+        """Scrollbar callback"""
+        if action == "moveto":
+            self.offset = int(float(value) * len(self.items))
+        elif action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            self.offset += int(value) * step
+        self.refresh()
+    
+    def scroll(self, lines):
+        self.offset += lines
+        self.refresh()
+    
+    def refresh(self):
+        """Redraw the visible rows and the scrollbar"""
+        total = len(self.items)
+        self.offset = max(0, min(self.offset, total - self.rows))
+        
+        self.listbox.delete(0, "end")
+        for index in range(self.offset, min(self.offset + self.rows, total)):
+            self.listbox.insert("end", self.render(self.items[index]))
+        if self.selected is not None and self.offset <= self.selected < self.offset + self.rows:
+            self.listbox.selection_set(self.selected - self.offset)
+        
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def _on_resize(self, event):
+        line_height = Font(font=self.listbox.cget("font")).metrics("linespace") or 1
+        rows = max(1, event.height // line_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.refresh()
+    
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected = self.offset + selection[0]
+    
+    def _on_mousewheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
 
 class ConverterGUI:
     def __init__(self, root):
@@ -60,7 +247,7 @@ class ConverterGUI:
                            fieldbackground="white", font=self.normal_font)
         
         # File list
-        self.files = []
+        self.files = FileList()
         
         # Create app title
         title_frame = Frame(root, bg=self.bg_color)
@@ -329,15 +516,13 @@ class ConverterGUI:
         scrollbar = Scrollbar(list_container)
         scrollbar.pack(side="right", fill="y")
         
-        # Listbox with custom colors
-        self.file_listbox = Listbox(list_container, width=80, height=12, font=self.normal_font,
-                                  bg="white", fg=self.text_color, bd=0, highlightthickness=0,
-                                  selectbackground=self.primary_color, selectforeground="white")
+        # Listbox with custom colors, only rendering the visible rows
+        self.file_listbox = VirtualListbox(list_container, self.files, os.path.basename, scrollbar,
+                                         width=80, height=12, font=self.normal_font,
+                                         bg="white", fg=self.text_color, bd=0, highlightthickness=0,
+                                         selectbackground=self.primary_color, selectforeground="white")
         self.file_listbox.pack(side="left", fill="both", expand=True)
         
-        scrollbar.config(command=self.file_listbox.yview)
-        self.file_listbox.config(yscrollcommand=scrollbar.set)
-        
         # Buttons for file management in a nice toolbar
         button_frame = Frame(file_frame, bg="white")
         button_frame.pack(fill="x", padx=10, pady=(0, 10))
@@ -345,12 +530,21 @@ class ConverterGUI:
         add_btn = ttk.Button(button_frame, text="➕ Add Files", command=self.add_files, style="TButton")
         add_btn.pack(side="left", padx=2)
         
+        add_folder_btn = ttk.Button(button_frame, text="📁 Add Folder", command=self.add_folder, style="TButton")
+        add_folder_btn.pack(side="left", padx=2)
+        
         remove_btn = ttk.Button(button_frame, text="➖ Remove Selected", command=self.remove_file, style="TButton")
         remove_btn.pack(side="left", padx=2)
         
         clear_btn = ttk.Button(button_frame, text="🗑️ Clear All", command=self.clear_files, style="TButton")
         clear_btn.pack(side="left", padx=2)
         
+        up_btn = ttk.Button(button_frame, text="▲", width=3, command=lambda: self.move_file(-1), style="TButton")
+        up_btn.pack(side="right", padx=2)
+        
+        down_btn = ttk.Button(button_frame, text="▼", width=3, command=lambda: self.move_file(1), style="TButton")
+        down_btn.pack(side="right", padx=2)
+        
         # Output options frame
         options_frame = Frame(self.tab2, bg="white", highlightbackground="#dddddd", 
                             highlightcolor="#dddddd", highlightthickness=1)
@@ -471,30 +665,83 @@ class ConverterGUI:
         )
         if file_paths:
             for file_path in file_paths:
-                if file_path not in self.files:
-                    self.files.append(file_path)
-                    self.file_listbox.insert("end", os.path.basename(file_path))
+                self.files.add(file_path)
             
             # Update file count
-            self.file_count_var.set(f"({len(self.files)} files)")
+            self.update_file_list()
+    
+    def add_folder(self):
+        """Recursively add all markdown files in a folder without blocking the window"""
+        folder_path = filedialog.askdirectory(title="Select Folder")
+        if folder_path:
+            self.status_var2.set(f"Scanning {folder_path}...")
+            self.status_icon2.config(text="⏳", fg="#f39c12")
+            self.add_folder_batch(self.scan_folder(folder_path))
+    
+    def scan_folder(self, folder_path):
+        """Yield every directory entry below a folder, as the path of a markdown file or None
+        
+        Entries that are not markdown files are yielded too, so a batch stops
+        after a fixed amount of scanning even in trees with few markdown files.
+        """
+        for dir_path, dir_names, file_names in os.walk(folder_path):
+            dir_names.sort()
+            yield from (None for _ in dir_names)
+            for filename in sorted(file_names):
+                if filename.lower().endswith(('.md', '.markdown')):
+                    yield os.path.join(dir_path, filename)
+                else:
+                    yield None
+    
+    def add_folder_batch(self, entries):
+        """Add the markdown files among the next batch of scanned entries and schedule the following one"""
+        for _ in range(FOLDER_SCAN_BATCH):
+            try:
+                path = next(entries)
+            except StopIteration:
+                self.update_file_list()
+                self.status_var2.set(f"Added folder ({len(self.files)} files in list)")
+                self.status_icon2.config(text="🔹", fg=self.primary_color)
+                return
+            if path is not None:
+                self.files.add(path)
+        
+        self.update_file_list()
+        self.root.after(1, self.add_folder_batch, entries)
+    
+    def update_file_list(self):
+        """Redraw the visible part of the file list and the file count"""
+        self.file_listbox.refresh()
+        self.file_count_var.set(f"({len(self.files)} files)")
     
     def remove_file(self):
         """Remove selected file from the list"""
-        try:
-            selected_index = self.file_listbox.curselection()[0]
-            self.file_listbox.delete(selected_index)
-            self.files.pop(selected_index)
-            
-            # Update file count
-            self.file_count_var.set(f"({len(self.files)} files)")
-        except (IndexError, TypeError):
+        selected_index = self.file_listbox.selection()
+        if selected_index is None or selected_index >= len(self.files):
             messagebox.showinfo("Info", "Please select a file to remove")
+            return
+        
+        self.files.remove(self.files[selected_index])
+        self.file_listbox.select(None)
+        
+        # Update file count
+        self.update_file_list()
+    
+    def move_file(self, offset):
+        """Move the selected file up or down in the list"""
+        selected_index = self.file_listbox.selection()
+        if selected_index is None or selected_index >= len(self.files):
+            messagebox.showinfo("Info", "Please select a file to move")
+            return
+        
+        new_index = self.files.move(self.files[selected_index], offset)
+        self.file_listbox.select(new_index)
     
     def clear_files(self):
         """Clear all files from the list"""
-        self.file_listbox.delete(0, "end")
-        self.files = []
-        self.file_count_var.set("(0 files)")
+        self.files.clear()
+        self.file_listbox.select(None)
+        self.update_file_list()
     
     def browse_output_combined(self):
         """Open file browser to select combined output file location"""
@@ -538,7 +785,7 @@ class ConverterGUI:
         try:
             if self.combine_var.get() == 1:
                 # Combine files
-                success, result = combine_files(self.files, output_path, output_format)
+                success, result = combine_files(list(self.files), output_path, output_format)
                 
                 if success:
                     self.status_var2.set(f"Successfully combined {len(self.files)} files into {result}")
@@ -548,10 +795,7 @@ class ConverterGUI:
                     self.status_icon2.config(text="❌", fg=self.warning_color)
             else:
                 # Convert each file individually
-                success_count = 0
-                error_count = 0
-                error_files = []
-                
+                file_pairs = []
                 for file_path in self.files:
                     # Generate output path if not specified
                     file_output = None
@@ -562,14 +806,9 @@ class ConverterGUI:
                                 output_path, 
                                 os.path.splitext(os.path.basename(file_path))[0] + f".{output_format}"
                             )
-                    
-                    success, result = convert_file(file_path, file_output, output_format)
-                    
-                    if success:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        error_files.append((os.path.basename(file_path), result))
+                    file_pairs.append((file_path, file_output))
+                
+                success_count, error_count, error_files = convert_files(file_pairs, output_format)
                 
                 if success_count > 0:
                     self.status_var2.set(
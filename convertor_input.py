@@ -0,0 +1,157 @@
+import os
+import time
+import mmap
+import codecs
+import itertools
+
+# Encodings tried in order for files without a byte order mark
+DEFAULT_ENCODINGS = ('utf-8', 'cp1252', 'latin-1')
+# Files at least this large are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1024 * 1024
+# Bytes decoded at a time when streaming a memory-mapped file
+DECODE_CHUNK = 1024 * 1024
+
+# Byte order marks, longest first so UTF-32 is not mistaken for UTF-16
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+def detect_bom(data):
+    """Return the encoding named by a byte order mark and the mark's length, or (None, 0)"""
+    for bom, encoding in BOMS:
+        if data[:len(bom)] == bom:
+            return encoding, len(bom)
+    return None, 0
+
+def decode_text(data, encoding, offset=0):
+    """Decode bytes from offset chunk by chunk and yield text with normalized newlines
+
+    Each piece but the last ends just after a newline, so no line spans two pieces.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for start in range(offset, len(data), DECODE_CHUNK):
+        final = start + DECODE_CHUNK >= len(data)
+        text = pending + decoder.decode(data[start:start + DECODE_CHUNK], final=final)
+
+        # Keep a trailing carriage return until we know whether a line feed follows
+        if not final and text.endswith('\r'):
+            pending = text[-1]
+            text = text[:-1]
+        else:
+            pending = ''
+
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if not final:
+            cut = text.rfind('\n') + 1
+            pending = text[cut:] + pending
+            text = text[:cut]
+        yield text
+
+def split_lines(data, encodings=None):
+    """Decode bytes and yield lists of their lines, with newlines normalized as by text mode reads
+
+    Lines never span two lists; small inputs give a single list.
+    """
+    encoding, offset = detect_bom(data)
+    candidates = [encoding] if encoding else list(encodings or DEFAULT_ENCODINGS)
+
+    # Small inputs are decoded in one go, trying each encoding on the same bytes
+    if len(data) < MMAP_THRESHOLD:
+        text = None
+        for candidate in candidates:
+            try:
+                text = str(data[offset:], candidate)
+                break
+            except UnicodeDecodeError as e:
+                error = e
+        if text is None:
+            raise error
+        yield text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return
+
+    # Each fallback encoding decodes the data once, its text held back until
+    # the whole file has decoded; the last one has no fallback and streams
+    pieces = None
+    for candidate in candidates[:-1]:
+        try:
+            pieces = list(decode_text(data, candidate, offset))
+            break
+        except UnicodeDecodeError:
+            pass
+    if pieces is None:
+        pieces = decode_text(data, candidates[-1], offset)
+
+    # A piece ending in a newline splits into its lines plus an empty string,
+    # which is the start of the next piece's first line
+    lines = ['']
+    for text in pieces:
+        first, *rest = text.split('\n')
+        lines[-1] += first
+        if rest:
+            head, lines = lines, rest
+            yield head
+    yield lines
+
+def iter_markdown_chunks(path, encodings=None):
+    """Yield the decoded lines of a markdown file, without line endings, in lists
+
+    Byte order marks select the encoding. Otherwise the encodings (by default
+    DEFAULT_ENCODINGS) are tried in order on the same bytes, so the file is
+    read only once and, unless an encoding fails, decoded only once. Files of
+    MMAP_THRESHOLD bytes or more are memory-mapped and decoded chunk by chunk;
+    with a single candidate encoding the lists are decoded while they are
+    consumed.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            yield from split_lines(f.read(), encodings)
+            return
+
+        # Slicing the map copies only the chunk being decoded
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from split_lines(mapped, encodings)
+
+def read_markdown(path, encodings=None):
+    """Read a markdown file as text, see iter_markdown_chunks"""
+    return '\n'.join(itertools.chain.from_iterable(iter_markdown_chunks(path, encodings)))
+
+def decode_markdown(data, encodings=None):
+    """Decode markdown bytes as text, with the same rules as read_markdown"""
+    return '\n'.join(itertools.chain.from_iterable(split_lines(data, encodings)))
+
+def benchmark_input(paths, repeat=3):
+    """Time reading files with a plain text-mode read against iter_markdown_chunks
+
+    Returns (plain_seconds, streamed_seconds), the best of repeat rounds of
+    reading and splitting all the files into lines. Files that are not UTF-8
+    are skipped by the plain read, which would fail on them.
+    """
+    def plain():
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    f.read().split('\n')
+            except UnicodeDecodeError:
+                pass
+
+    def streamed():
+        for path in paths:
+            for _ in iter_markdown_chunks(path):
+                pass
+
+    timings = []
+    for reader in (plain, streamed):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            reader()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+    return tuple(timings)
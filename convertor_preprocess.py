@@ -0,0 +1,216 @@
+import time
+import itertools
+import threading
+
+# Lines passed through all stages at a time
+CHUNK_LINES = 1024
+
+class Stage:
+    """A preprocessing stage that sees the document one line at a time
+
+    A new instance is created for every document, so stages can keep state
+    in attributes. process() appends the lines that replace the given line to
+    output (none to drop it, several to insert lines) and finish() appends any
+    lines still held back at the end of the document.
+    """
+    def process(self, line, output):
+        output.append(line)
+
+    def finish(self, output):
+        pass
+
+class BlockStage(Stage):
+    """A preprocessing stage that sees the document one block at a time
+
+    Blocks are runs of non-blank lines. process_block() receives the lines of
+    a block and returns the lines to replace it with; the blank lines between
+    blocks are passed on unchanged.
+    """
+    def __init__(self):
+        self.block = []
+
+    def process(self, line, output):
+        if line.strip():
+            self.block.append(line)
+            return
+        self.flush(output)
+        output.append(line)
+
+    def finish(self, output):
+        self.flush(output)
+
+    def flush(self, output):
+        if self.block:
+            output.extend(self.process_block(self.block))
+            self.block = []
+
+    def process_block(self, lines):
+        return lines
+
+class LineHandler(Stage):
+    """Stage calling a function for each line, see Pipeline.add_line_handler"""
+    def __init__(self, handler):
+        self.handler = handler
+
+    def process(self, line, output):
+        result = self.handler(line)
+        if isinstance(result, str):
+            output.append(result)
+        elif result is not None:
+            output.extend(result)
+
+class BlockHandler(BlockStage):
+    """Stage calling a function for each block, see Pipeline.add_block_handler"""
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def process_block(self, lines):
+        return self.handler(lines)
+
+class ListFormattingStage(Stage):
+    """Ensure proper list formatting by adding blank lines before and after lists
+    and ensuring each list item is properly formatted with spaces"""
+    def __init__(self):
+        self.in_list = False
+        self.previous = None  # Last line written to the output
+
+    def process(self, line, output):
+        stripped = line.strip()
+
+        # Check if this line is a list item
+        is_bullet = stripped.startswith(('-', '*', '+'))
+        is_numbered = not is_bullet and stripped[:1].isdigit() and '.' in stripped[:3]
+        is_list_item = is_bullet or is_numbered
+
+        # If entering a list
+        if is_list_item and not self.in_list:
+            self.in_list = True
+            # Ensure there's a blank line before the list if not at the beginning
+            if self.previous is not None and self.previous.strip():
+                output.append('')
+
+        # If exiting a list
+        elif not is_list_item and self.in_list and stripped:
+            self.in_list = False
+            # Ensure there's a blank line after the list
+            if self.previous is not None and self.previous.strip():
+                output.append('')
+
+        # Process list items to ensure proper formatting
+        if is_bullet:
+            # For bullet lists, ensure proper spacing
+            marker = stripped[0]
+            text = stripped[1:].strip()
+            # Ensure the list item has a space after the marker
+            line = f"{marker} {text}"
+        elif is_numbered:
+            # For numbered lists, ensure proper spacing
+            parts = stripped.split('.', 1)
+            number = parts[0]
+            text = parts[1].strip()
+            # Ensure the list item has a space after the marker
+            line = f"{number}. {text}"
+
+        output.append(line)
+        self.previous = line
+
+class Pipeline:
+    """Preprocessing stages fused into a single pass over the document
+
+    The input is read in chunks of lines, CHUNK_LINES at a time unless the
+    caller provides its own chunks, and each chunk is passed through all
+    stages in registration order before the next one is read, so adding
+    stages does not add passes over the text. The time spent in each stage is
+    accumulated in timings.
+    """
+    def __init__(self):
+        self.stages = []
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, factory):
+        """Register a stage; factory is called once per document to create the Stage"""
+        self.stages.append((name, factory))
+        self.timings.setdefault(name, 0.0)
+
+    def add_line_handler(self, name, handler):
+        """Register a function called with each line
+
+        It returns the replacement line, a list of lines, or None to drop the line.
+        """
+        self.add_stage(name, lambda: LineHandler(handler))
+
+    def add_block_handler(self, name, handler):
+        """Register a function called with the lines of each block, returning the new lines"""
+        self.add_stage(name, lambda: BlockHandler(handler))
+
+    def remove_stage(self, name):
+        self.stages = [(stage_name, factory) for stage_name, factory in self.stages if stage_name != name]
+
+    def run(self, lines, timings=None):
+        """Run all stages over an iterable of lines (without line endings) and return the new lines
+
+        If a timings dict is given the seconds spent in each stage are added to it.
+        """
+        lines = iter(lines)
+        chunks = iter(lambda: list(itertools.islice(lines, CHUNK_LINES)), [])
+        return self.run_chunks(chunks, timings)
+
+    def run_chunks(self, chunks, timings=None):
+        """Run all stages over an iterable of lists of lines and return the new lines
+
+        Lets a reader that already produces lines in batches, such as
+        convertor_input.iter_markdown_chunks, feed the pipeline directly.
+        """
+        names = [name for name, _ in self.stages]
+        stages = [factory() for _, factory in self.stages]
+        elapsed = [0.0] * len(stages)
+
+        result = []
+        for chunk in chunks:
+            result.extend(self.feed(stages, elapsed, 0, chunk))
+
+        # Flush each stage in turn, passing what it held back through the later stages
+        for i, stage in enumerate(stages):
+            start = time.perf_counter()
+            output = []
+            stage.finish(output)
+            elapsed[i] += time.perf_counter() - start
+            result.extend(self.feed(stages, elapsed, i + 1, output))
+
+        with self.lock:
+            for name, seconds in zip(names, elapsed):
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if timings is not None:
+            for name, seconds in zip(names, elapsed):
+                timings[name] = timings.get(name, 0.0) + seconds
+
+        return result
+
+    def run_text(self, content, timings=None):
+        """Run all stages over markdown text and return the new text"""
+        return '\n'.join(self.run(content.split('\n'), timings))
+
+    def feed(self, stages, elapsed, index, lines):
+        """Pass lines through the stages from index onwards"""
+        for i in range(index, len(stages)):
+            if not lines:
+                break
+            process = stages[i].process
+            start = time.perf_counter()
+            output = []
+            for line in lines:
+                process(line, output)
+            elapsed[i] += time.perf_counter() - start
+            lines = output
+        return lines
+
+def default_pipeline():
+    """Create a pipeline with the default stages"""
+    pipeline = Pipeline()
+    pipeline.add_stage('lists', ListFormattingStage)
+    return pipeline
+
+# Pipeline used by all conversions; register extra stages on it
+DEFAULT_PIPELINE = default_pipeline()
@@ -0,0 +1,111 @@
+import os
+import time
+import pstats
+import cProfile
+import threading
+
+# Stages a conversion's wall time is divided into, in report order
+STAGES = ('preprocess', 'engine', 'pandoc', 'other')
+
+class ConversionProfiler:
+    """Profile conversions, separating our Python code from the pandoc processes
+
+    Every conversion run through the profiler gets its own cProfile profile
+    and its stage timings and pandoc resource usage are recorded for the
+    per-file report. Only one profiler can be active at a time on Python 3.12
+    and later, where cProfile is built on sys.monitoring, so conversions from
+    the scheduler's worker threads are profiled one at a time; run them with a
+    single worker to avoid the waiting.
+    """
+    def __init__(self):
+        self.profiles = []
+        self.records = []
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()
+
+    def run(self, name, function, *args, stats=None, **kwargs):
+        """Call a conversion function that accepts a stats dict under the profiler"""
+        if stats is None:
+            stats = {}
+        with self.profiling:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool, such as a debugger or coverage, holds
+                # the sys.monitoring profiler slot; record the timings only
+                profile = None
+            start = time.perf_counter()
+            try:
+                return function(*args, stats=stats, **kwargs)
+            finally:
+                wall_time = time.perf_counter() - start
+                if profile is not None:
+                    profile.disable()
+                with self.lock:
+                    if profile is not None:
+                        self.profiles.append(profile)
+                    self.records.append((name, wall_time, dict(stats)))
+
+    def dump(self, path):
+        """Write the merged Python profile as a pstats file"""
+        if not self.profiles:
+            return
+        merged = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            merged.add(profile)
+        merged.dump_stats(path)
+
+    def stage_times(self, wall_time, stats):
+        """Split a conversion's wall time into the time spent in each stage"""
+        pandoc_time = stats.get('pandoc_time', 0.0)
+        # Preprocessing includes reading and decoding the input
+        stages = {
+            'preprocess': stats.get('preprocess_time', 0.0),
+            'engine': max(0.0, stats.get('convert_time', 0.0) - pandoc_time),
+            'pandoc': pandoc_time,
+        }
+        stages['other'] = max(0.0, wall_time - sum(stages.values()))
+        return stages
+
+    def report(self, top=10):
+        """Return a text report of the slowest files and the stage dominating each"""
+        if not self.records:
+            return "No conversions were profiled"
+
+        records = sorted(self.records, key=lambda record: record[1], reverse=True)
+        totals = dict.fromkeys(STAGES, 0.0)
+        pandoc_cpu = 0.0
+        preprocess_stages = {}
+        for _, wall_time, stats in records:
+            for stage, seconds in self.stage_times(wall_time, stats).items():
+                totals[stage] += seconds
+            for stage, seconds in stats.get('preprocess_stages', {}).items():
+                preprocess_stages[stage] = preprocess_stages.get(stage, 0.0) + seconds
+            pandoc_cpu += stats.get('cpu_time', 0.0) if 'pandoc_time' in stats else 0.0
+
+        wall_total = sum(record[1] for record in records)
+        python_total = wall_total - totals['pandoc']
+        lines = [
+            f"Profiled {len(records)} conversions: {wall_total:.2f} s in total, "
+            f"{python_total:.2f} s in Python, {totals['pandoc']:.2f} s waiting for pandoc "
+            f"({pandoc_cpu:.2f} s pandoc CPU)",
+            "Time per stage: " + ", ".join(f"{stage} {totals[stage]:.2f} s" for stage in STAGES),
+            "Preprocessing stages: " + ", ".join(f"{stage} {seconds:.3f} s"
+                                                 for stage, seconds in preprocess_stages.items()),
+            "",
+            f"Slowest {min(top, len(records))} files:",
+            f"{'file':<32} {'total':>8} {'prep':>7} {'engine':>7} {'pandoc':>7} "
+            f"{'user':>7} {'sys':>7} {'rss MB':>7}  dominant",
+        ]
+        for name, wall_time, stats in records[:top]:
+            stages = self.stage_times(wall_time, stats)
+            dominant = max(stages, key=stages.get)
+            max_rss = stats.get('max_rss')
+            rss = f"{max_rss / (1024 * 1024):7.1f}" if max_rss else f"{'-':>7}"
+            lines.append(
+                f"{os.path.basename(name)[:32]:<32} {wall_time:8.3f} {stages['preprocess']:7.3f} "
+                f"{stages['engine']:7.3f} {stages['pandoc']:7.3f} "
+                f"{stats.get('user_time', 0.0):7.3f} {stats.get('sys_time', 0.0):7.3f} {rss}  {dominant}"
+            )
+        return "\n".join(lines)
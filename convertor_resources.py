@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import base64
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Output formats into which pandoc embeds the images a document refers to
+EMBEDDING_FORMATS = ('docx', 'odt', 'epub', 'pdf', 'rtf')
+
+# Local image references in markdown and in inline HTML
+MARKDOWN_IMAGE = re.compile(r'(!\[[^\]]*\]\(\s*)<?([^)\s>]+)>?((?:\s+"[^"]*")?\s*\))')
+HTML_IMAGE = re.compile(r'(<img\s[^>]*?src=")([^"]+)(")')
+REMOTE_PREFIXES = ('http://', 'https://', 'data:', 'file:')
+
+# Code blocks and code spans, whose text is shown as is and never rewritten
+CODE_FENCE = re.compile(r'[ \t]*(`{3,}|~{3,})')
+INDENTED_CODE = re.compile(r'(?: {4}|\t)')
+LIST_ITEM = re.compile(r'[ \t]*(?:[-*+]|\d+[.)])(?:[ \t]|$)')
+CODE_SPAN = re.compile(r'(?<!`)(`+)(?!`)(?:(?!\n[ \t]*\n).)*?(?<!`)\1(?!`)', re.DOTALL)
+
+# File in a persistent cache folder mapping source files to their content hash
+INDEX_FILENAME = 'index.json'
+
+def code_regions(content):
+    """Split markdown into (is_code, text) parts, code being code blocks and code spans
+
+    Indented lines inside list items are list content rather than code.
+    """
+    lines = []
+    fence = None
+    in_list = False
+    previous_blank = True
+    previous_code = False
+    for line in content.splitlines(True):
+        blank = not line.strip()
+        if fence is not None:
+            # The fence closes with at least as many of the same characters
+            closing = CODE_FENCE.match(line)
+            if closing and closing.group(1)[0] == fence[0] and len(closing.group(1)) >= len(fence) \
+                    and not line[closing.end():].strip():
+                fence = None
+            code = True
+        elif not blank and INDENTED_CODE.match(line) and (previous_blank or previous_code) and not in_list:
+            code = True
+        elif CODE_FENCE.match(line):
+            fence = CODE_FENCE.match(line).group(1)
+            code = True
+        else:
+            code = False
+            if LIST_ITEM.match(line):
+                in_list = True
+            elif not blank and not line[:1].isspace():
+                in_list = False
+        lines.append((code, line))
+        previous_code = code and fence is None and not blank
+        previous_blank = blank
+
+    parts = []
+    for code, line in lines:
+        if parts and parts[-1][0] == code:
+            parts[-1][1].append(line)
+        else:
+            parts.append((code, [line]))
+
+    for code, block in parts:
+        text = ''.join(block)
+        if code:
+            yield True, text
+            continue
+        position = 0
+        for span in CODE_SPAN.finditer(text):
+            yield False, text[position:span.start()]
+            yield True, span.group(0)
+            position = span.end()
+        yield False, text[position:]
+
+class DocumentResources:
+    """The cached resources one document refers to"""
+    def __init__(self, cache):
+        self.cache = cache
+        self.directory = cache.directory
+        self.names = set()
+
+    def encoded(self, name):
+        return self.cache.encoded(name)
+
+class ResourceCache:
+    """Content-addressed cache of the images and media referenced by documents
+
+    Each referenced file is hashed once per (path, modification time, size) and
+    stored in the cache folder under its content hash, so an asset shared by
+    many documents is read and stored once and documents refer to it by hash.
+    With a cache_dir the cache and its index persist across runs; without one
+    a temporary folder is used and removed by close().
+    """
+    def __init__(self, cache_dir=None):
+        self.persistent = cache_dir is not None
+        if self.persistent:
+            self.directory = os.path.abspath(cache_dir)
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+        else:
+            self.directory = tempfile.mkdtemp(prefix='temp_resources_')
+
+        self.index = {}
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if self.persistent and os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+        self.encodings = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+
+    def resolve(self, path):
+        """Return the cached file name for a source file, adding it to the cache if needed
+
+        Files are hashed and copied without holding the lock, which only guards
+        the index and the counters, so conversions resolving different images
+        do not wait for each other.
+        """
+        info = os.stat(path)
+        key = f"{os.path.abspath(path)}|{info.st_mtime_ns}|{info.st_size}"
+        with self.lock:
+            name = self.index.get(key)
+        if name is not None and os.path.exists(os.path.join(self.directory, name)):
+            with self.lock:
+                self.hits += 1
+            return name
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+
+        # Identical content under different paths is stored only once
+        name = digest.hexdigest() + os.path.splitext(path)[1].lower()
+        cached_path = os.path.join(self.directory, name)
+        if not os.path.exists(cached_path):
+            # Copy under a unique name and move it into place, so a concurrent
+            # copy of the same content never exposes a partial file
+            fd, temp_path = tempfile.mkstemp(prefix='temp_', dir=self.directory)
+            os.close(fd)
+            try:
+                shutil.copyfile(path, temp_path)
+                os.replace(temp_path, cached_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        with self.lock:
+            self.misses += 1
+            self.bytes_read += info.st_size
+            self.index[key] = name
+        return name
+
+    def encoded(self, name):
+        """Return the base64 encoding of a cached file, encoding it only once"""
+        with self.lock:
+            encoding = self.encodings.get(name)
+        if encoding is None:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                encoding = base64.b64encode(f.read()).decode('ascii')
+            with self.lock:
+                encoding = self.encodings.setdefault(name, encoding)
+        return encoding
+
+    def rewrite(self, content, base_dir, resources=None):
+        """Point the local image references in markdown at the cache
+
+        References inside code blocks and code spans are left as they are.
+        Relative paths are looked up next to the document first and then in the
+        current directory. References that cannot be found are left alone.
+        Returns the new content and the DocumentResources it refers to, adding
+        to resources if one is given.
+        """
+        if resources is None:
+            resources = DocumentResources(self)
+
+        def replace(match):
+            target = match.group(2)
+            if target.lower().startswith(REMOTE_PREFIXES):
+                return match.group(0)
+            for candidate in (os.path.join(base_dir or '.', target), target):
+                if os.path.isfile(candidate):
+                    name = self.resolve(candidate)
+                    resources.names.add(name)
+                    return match.group(1) + name + match.group(3)
+            return match.group(0)
+
+        parts = []
+        for code, text in code_regions(content):
+            if not code:
+                text = HTML_IMAGE.sub(replace, MARKDOWN_IMAGE.sub(replace, text))
+            parts.append(text)
+        return ''.join(parts), resources
+
+    def summary(self):
+        """Return a one-line description of the cache statistics"""
+        unique = len(set(self.index.values()))
+        return (f"Resource cache: {self.hits} hits, {self.misses} misses, {unique} unique assets, "
+                f"{self.bytes_read / (1024 * 1024):.1f} MB read")
+
+    def save(self):
+        """Write the index of a persistent cache so the next run can reuse it"""
+        if self.persistent:
+            with self.lock:
+                with open(os.path.join(self.directory, INDEX_FILENAME), 'w', encoding='utf-8') as f:
+                    json.dump(self.index, f)
+
+    def close(self):
+        if self.persistent:
+            self.save()
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
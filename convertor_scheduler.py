@@ -0,0 +1,134 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Assumed memory use of a pandoc process before any job has been measured
+DEFAULT_BASE_MEMORY = 100 * 1024 * 1024
+# Assumed peak memory per byte of markdown input before any job has been measured
+DEFAULT_MEMORY_RATIO = 20.0
+# Inputs at least this large measure the memory needed per byte of input,
+# smaller ones mostly measure the memory of the pandoc process itself
+MEMORY_SAMPLE_SIZE = 64 * 1024
+# Default upper bound on the workers per core, for jobs that mostly wait on
+# process start-up or I/O
+WORKERS_PER_CPU = 4
+# Weight given to each new observation of the CPU use of a job
+SMOOTHING = 0.3
+
+def physical_memory():
+    """Return the total physical memory in bytes, or None if it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+class AdaptiveScheduler:
+    """Run conversion jobs concurrently, adapting the worker count to observed load
+
+    Each job reports the CPU time and peak memory of its conversion. From these
+    the scheduler estimates how many cores a job keeps busy and how much memory a
+    job of a given input size needs. It then runs as many jobs as keep the
+    cores busy, within min_workers and max_workers (WORKERS_PER_CPU per core by
+    default): more jobs than cores when they spend their time waiting, fewer
+    when each one uses several cores. A job is only started if its estimated
+    memory fits in memory_budget next to the jobs already running; the estimate
+    uses the largest memory use observed so far, so it errs on the high side.
+    Large inputs are started first so they do not end up as stragglers.
+    """
+    def __init__(self, min_workers=1, max_workers=None, memory_budget=None):
+        cpu_count = os.cpu_count() or 1
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers or cpu_count * WORKERS_PER_CPU)
+
+        # By default leave half of the physical memory for everything else
+        if memory_budget is None:
+            total_memory = physical_memory()
+            memory_budget = total_memory // 2 if total_memory else None
+        self.memory_budget = memory_budget
+
+        self.cpu_count = cpu_count
+        self.limit = max(self.min_workers, min(cpu_count, self.max_workers))
+        self.cpu_utilization = None
+        self.base_memory = DEFAULT_BASE_MEMORY
+        self.memory_ratio = DEFAULT_MEMORY_RATIO
+        self.base_measured = False
+        self.ratio_measured = False
+        self.peak_workers = 0
+
+    def estimate_memory(self, size):
+        """Estimate the peak memory of converting an input of the given size"""
+        return self.base_memory + self.memory_ratio * size
+
+    def record(self, size, wall_time, stats, concurrency=1):
+        """Update the estimates from the measurements of a finished job
+
+        concurrency is the largest number of jobs that ran alongside it,
+        including itself.
+        """
+        cpu_time = stats.get('cpu_time')
+        if cpu_time is not None and wall_time > 0:
+            # With more jobs than cores a job only gets a share of a core, so its
+            # wall time is longer than its own demand would make it
+            share = min(1.0, self.cpu_count / max(concurrency, 1))
+            utilization = cpu_time / (wall_time * share)
+            if self.cpu_utilization is None:
+                self.cpu_utilization = utilization
+            else:
+                self.cpu_utilization += SMOOTHING * (utilization - self.cpu_utilization)
+
+            # Jobs that leave the CPU idle (process start-up, I/O) can overlap
+            # more, jobs using several cores each need fewer workers than cores
+            target = round(self.cpu_count / max(self.cpu_utilization, 0.1))
+            self.limit = max(self.min_workers, min(self.max_workers, target))
+
+        max_rss = stats.get('max_rss')
+        if max_rss:
+            if size < MEMORY_SAMPLE_SIZE:
+                self.base_memory = max(self.base_memory, max_rss) if self.base_measured else max_rss
+                self.base_measured = True
+            else:
+                ratio = max(0.0, (max_rss - self.base_memory) / size)
+                self.memory_ratio = max(self.memory_ratio, ratio) if self.ratio_measured else ratio
+                self.ratio_measured = True
+
+    def run(self, jobs):
+        """Run jobs and return their results in the order the jobs were given
+
+        Each job is a (size, function) pair. The function is called with a dict
+        to fill in with 'cpu_time' and 'max_rss' and its return value is the
+        job's result.
+        """
+        results = [None] * len(jobs)
+        pending = sorted(range(len(jobs)), key=lambda i: jobs[i][0], reverse=True)
+        running = {}
+
+        def run_job(index):
+            stats = {}
+            start = time.perf_counter()
+            result = jobs[index][1](stats)
+            return result, time.perf_counter() - start, stats
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Start the largest pending jobs that fit in the worker and memory limits
+                for index in list(pending):
+                    if len(running) >= self.limit:
+                        break
+                    size = jobs[index][0]
+                    estimate = self.estimate_memory(size)
+                    in_use = sum(memory for _, memory, _ in running.values())
+                    if running and self.memory_budget is not None and in_use + estimate > self.memory_budget:
+                        continue
+                    pending.remove(index)
+                    running[executor.submit(run_job, index)] = [index, estimate, 0]
+                self.peak_workers = max(self.peak_workers, len(running))
+                for entry in running.values():
+                    entry[2] = max(entry[2], len(running))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, _, concurrency = running.pop(future)
+                    results[index], wall_time, stats = future.result()
+                    self.record(jobs[index][0], wall_time, stats, concurrency)
+
+        return results
@@ -0,0 +1,431 @@
+import os
+import re
+import json
+import time
+import bisect
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from convertor_engines import pandoc_identifier, run_pandoc
+
+# Inputs larger than this are split at top-level headings and parsed in parallel
+SPLIT_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+# Chunks are parsed without automatic identifiers, which are assigned once on
+# the merged document so duplicate headings in different chunks stay unique
+CHUNK_FORMAT = 'markdown-auto_identifiers'
+
+# HTML tags and comments, which may enclose blank lines and headings
+HTML_TAG = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9-]*)(?=[\s/>])[^>]*?(/?)>')
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                 'source', 'track', 'wbr'}
+CODE_SPAN = re.compile(r'(`+).*?\1')
+
+# Link reference and footnote definitions, which apply to the whole document
+LINK_DEFINITION = re.compile(r' {0,3}\[(?!\^)([^\]]+)\]:')
+NOTE_DEFINITION = re.compile(r' {0,3}\[\^[^\]\s]+\]:')
+DEFINITION_LABEL = re.compile(r' {0,3}\[([^\]]+)\]:')
+
+# Headings, whose text can be used as an implicit link to them
+ATX_HEADING = re.compile(r' {0,3}#{1,6}(?:[ \t]+|$)')
+SETEXT_UNDERLINE = re.compile(r' {0,3}(?:=+|-+)[ \t]*$')
+HEADING_ATTRIBUTES = re.compile(r'[ \t]*\{[^}]*\}[ \t]*$')
+
+# Pandoc derives the identifier of a heading containing a reference link or a
+# footnote from its raw text, which the parsed document no longer has
+RAW_TEXT_HEADING = re.compile(r'\[\^|\]\[[^\]]')
+# Pandoc numbers the headings in footnotes where the notes are defined
+NOTE_HEADING = re.compile(r'^(?: {4}|\t) {0,3}(?:#{1,6}(?:[ \t]|$)|=+[ \t]*$|-+[ \t]*$)', re.MULTILINE)
+# Links to an empty section name, which would be mistaken for implicit heading links
+EMPTY_SECTION_LINK = re.compile(r'\]\(\s*<?#>?\s*\)|^ {0,3}\[[^\]]+\]:\s*<?#>?\s*$', re.MULTILINE)
+# First line of a YAML metadata block, a mapping key; otherwise --- is a rule
+YAML_KEY = re.compile(r'[A-Za-z0-9_-]+:(?:\s|$)')
+# Example lists are numbered across the whole document
+EXAMPLE_LIST = re.compile(r'^[ \t]*\(@[\w-]*\)', re.MULTILINE)
+# Link and footnote definitions inside block quotes and list items, which also
+# apply to the whole document but cannot be copied out of their container
+NESTED_DEFINITION = re.compile(
+    r'^(?:[ \t]*(?:>|(?:[-*+]|\d+[.)])[ \t])| {4}|\t)[ \t>]*\[[^\]]+\]:', re.MULTILINE)
+
+def html_state(line, in_comment, depth):
+    """Update the HTML comment flag and element nesting depth for one line"""
+    position = 0
+    while True:
+        if in_comment:
+            end = line.find('-->', position)
+            if end < 0:
+                return True, depth
+            in_comment = False
+            position = end + 3
+        start = line.find('<!--', position)
+        segment = line[position:] if start < 0 else line[position:start]
+        for closing, tag, self_closing in HTML_TAG.findall(CODE_SPAN.sub('', segment)):
+            if self_closing or tag.lower() in VOID_ELEMENTS:
+                continue
+            depth = max(0, depth - 1) if closing else depth + 1
+        if start < 0:
+            return False, depth
+        in_comment = True
+        position = start + 4
+
+def heading_key(text):
+    """Return the reference key of a heading's text, as pandoc normalizes link labels"""
+    text = HEADING_ATTRIBUTES.sub('', text).strip()
+    # A closing sequence of #s is not part of the heading text
+    stripped = text.rstrip('#')
+    if stripped != text and (not stripped or stripped[-1] in ' \t'):
+        text = stripped
+    return ' '.join(text.lower().split())
+
+def scan_markdown(lines):
+    """Find where markdown can be split and what every part needs from the rest
+
+    Returns (boundaries, definitions, headings, safe). boundaries are the
+    indexes of the top-level "# " headings the document can be split at,
+    definitions are (line index, text) pairs of the link reference and
+    footnote definitions, and headings are (line index, key) pairs. safe is
+    False when the document uses constructs that cannot be parsed in parts.
+    """
+    boundaries = []
+    definitions = []
+    headings = []
+    fence = None
+    in_comment = False
+    html_depth = 0
+    div_depth = 0
+    in_metadata = len(lines) > 1 and lines[0].strip() == '---' and YAML_KEY.match(lines[1]) is not None
+    i = 0
+    previous = ''
+    after_definition = False  # Definitions may follow each other without blank lines
+
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        follows_definition, after_definition = after_definition, False
+
+        # Skip over YAML metadata blocks
+        if in_metadata:
+            if i > 0 and stripped in ('---', '...'):
+                in_metadata = False
+            previous = line
+            i += 1
+            continue
+
+        # Track fenced code blocks (``` or ~~~, closed by an equal or longer fence)
+        indent = len(line) - len(line.lstrip(' '))
+        if indent <= 3 and not in_comment and stripped[:3] in ('```', '~~~'):
+            marker = stripped[0]
+            run = len(stripped) - len(stripped.lstrip(marker))
+            if fence is None:
+                fence = (marker, run)
+            elif marker == fence[0] and run >= fence[1] and not stripped.lstrip(marker):
+                fence = None
+            previous = line
+            i += 1
+            continue
+        if fence is not None:
+            previous = line
+            i += 1
+            continue
+
+        # Track HTML elements and comments, skipping indented code
+        if in_comment or (indent < 4 and '<' in line):
+            in_comment, html_depth = html_state(line, in_comment, html_depth)
+
+        blank_before = not previous.strip()
+        if not in_comment and indent <= 3:
+            # Track fenced divs, which are closed by a line of colons only
+            if stripped.startswith(':::'):
+                if stripped.strip(':').strip():
+                    div_depth += 1
+                elif div_depth:
+                    div_depth -= 1
+
+            # Collect definitions with their continuation lines
+            elif (blank_before or follows_definition or ATX_HEADING.match(previous)) and (
+                    NOTE_DEFINITION.match(line) or LINK_DEFINITION.match(line)):
+                is_note = NOTE_DEFINITION.match(line) is not None
+                end = i + 1
+                while end < len(lines):
+                    following = lines[end]
+                    if following.strip():
+                        # Notes take lazy continuation lines, links only an indented title
+                        if not is_note and following[:1] not in (' ', '\t'):
+                            break
+                        end += 1
+                    elif (is_note and end + 1 < len(lines)
+                          and lines[end + 1].startswith(('    ', '\t'))):
+                        end += 1
+                    else:
+                        break
+                definitions.append((i, '\n'.join(lines[i:end])))
+                previous = lines[end - 1]
+                after_definition = True
+                i = end
+                continue
+
+            elif ATX_HEADING.match(line):
+                headings.append((i, heading_key(ATX_HEADING.sub('', line, count=1))))
+                # A top-level ATX heading needs a blank line before it to be a heading
+                if ((line.startswith('# ') or line == '#') and i > 0 and blank_before
+                        and not html_depth and not div_depth):
+                    boundaries.append(i)
+
+            elif stripped and i + 1 < len(lines) and SETEXT_UNDERLINE.match(lines[i + 1]):
+                headings.append((i, heading_key(line)))
+
+        # A metadata block may start anywhere after a blank line
+        if stripped == '---' and blank_before and i + 1 < len(lines) and YAML_KEY.match(lines[i + 1]):
+            in_metadata = True
+
+        previous = line
+        i += 1
+
+    # Text appended to the last part would end up inside an unclosed block
+    safe = fence is None and not in_comment and not html_depth and not div_depth
+    return boundaries, definitions, headings, safe
+
+def split_markdown_at_headings(content, max_chunks):
+    """Split markdown into at most max_chunks pieces at top-level headings
+
+    Only "# " headings preceded by a blank line are used as boundaries, never
+    inside code blocks, HTML blocks or comments, fenced divs or metadata.
+    Every piece gets a copy of the link reference and footnote definitions
+    of the other pieces, and a reference to each heading in them, so links,
+    footnotes and implicit heading links resolve as in the whole document.
+    Returns [content] when the document cannot be split safely.
+    """
+    lines = content.split('\n')
+    boundaries, definitions, headings, safe = scan_markdown(lines)
+    if not boundaries or max_chunks < 2 or not safe:
+        return [content]
+
+    # Some constructs depend on the whole document in ways the merge cannot restore
+    if (EMPTY_SECTION_LINK.search(content) or EXAMPLE_LIST.search(content)
+            or NESTED_DEFINITION.search(content)
+            or any(RAW_TEXT_HEADING.search(lines[i]) for i, _ in headings)
+            or any(NOTE_HEADING.search(text) for _, text in definitions)):
+        return [content]
+
+    # Group the sections into chunks of roughly equal size
+    target_size = len(content) // max_chunks + 1
+    starts = [0]
+    size = 0
+    previous = 0
+    for boundary in boundaries:
+        size += sum(len(line) + 1 for line in lines[previous:boundary])
+        previous = boundary
+        if size >= target_size:
+            starts.append(boundary)
+            size = 0
+    if len(starts) < 2:
+        return [content]
+    ends = starts[1:] + [len(lines)]
+
+    def chunk_of(index):
+        return bisect.bisect_right(starts, index) - 1
+
+    def label(text):
+        return ' '.join(DEFINITION_LABEL.match(text).group(1).lower().split())
+
+    # When a label is defined twice the last definition applies
+    last_definitions = {label(text): (i, text) for i, text in definitions}
+
+    # Implicit heading links resolve to the first heading with the text; they
+    # are given as references to an empty section and resolved after merging
+    first_headings = {}
+    for i, key in headings:
+        if key and key not in last_definitions:
+            first_headings.setdefault(key, chunk_of(i))
+
+    chunks = []
+    for number, (start, end) in enumerate(zip(starts, ends)):
+        extra = [text for i, text in last_definitions.values() if not start <= i < end]
+        extra.extend(f"[{key}]: #" for key, chunk in first_headings.items() if chunk != number)
+        chunk = '\n'.join(lines[start:end])
+        if extra:
+            chunk += '\n\n' + '\n\n'.join(extra) + '\n'
+        chunks.append(chunk)
+
+    return chunks
+
+def stringify(inlines):
+    """Return the plain text of inline elements, as pandoc uses it for identifiers"""
+    parts = []
+    for inline in inlines:
+        kind = inline['t']
+        content = inline.get('c')
+        if kind == 'Str':
+            parts.append(content)
+        elif kind in ('Space', 'SoftBreak', 'LineBreak'):
+            parts.append(' ')
+        elif kind in ('Code', 'Math'):
+            parts.append(content[1])
+        elif kind == 'RawInline':
+            if content[0] == 'html' and content[1].startswith('<br'):
+                parts.append(' ')
+        elif kind in ('Quoted', 'Cite', 'Span', 'Link', 'Image'):
+            parts.append(stringify(content[1]))
+        elif kind != 'Note' and isinstance(content, list):
+            parts.append(stringify(content))
+    return ''.join(parts)
+
+def make_identifier(inlines):
+    """Return pandoc's automatic identifier for a heading, before making it unique"""
+    return pandoc_identifier(stringify(inlines))
+
+def iter_elements(nodes):
+    """Yield every element of a pandoc JSON AST in document order"""
+    stack = [iter(nodes)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, dict):
+                yield node
+                content = node.get('c')
+                if isinstance(content, list):
+                    stack.append(iter(content))
+                    break
+            elif isinstance(node, list):
+                stack.append(iter(node))
+                break
+        else:
+            stack.pop()
+
+def assign_identifiers(document):
+    """Give headings pandoc's automatic identifiers and resolve implicit heading links"""
+    used = set()
+    first_ids = {}
+    section_links = []
+    for element in iter_elements(document['blocks']):
+        kind = element['t']
+        if kind == 'Header':
+            attr, inlines = element['c'][1], element['c'][2]
+            if not attr[0]:
+                base = make_identifier(inlines) or 'section'
+                identifier = base
+                number = 0
+                while identifier in used:
+                    number += 1
+                    identifier = f"{base}-{number}"
+                attr[0] = identifier
+            used.add(attr[0])
+            first_ids.setdefault(' '.join(stringify(inlines).lower().split()), attr[0])
+        elif kind == 'Link' and element['c'][2][0] == '#':
+            section_links.append(element)
+
+    # Links to headings point at the first heading with that text
+    for link in section_links:
+        identifier = first_ids.get(' '.join(stringify(link['c'][1]).lower().split()))
+        if identifier:
+            link['c'][2][0] = '#' + identifier
+
+def add_usage(total, usage):
+    """Add the resource usage of one pandoc process, as run_pandoc returns it, to a total
+
+    CPU times add up and the peak memory is the largest of any process.
+    """
+    if not usage:
+        return
+    for key in ('cpu_time', 'user_time', 'sys_time'):
+        total[key] = total.get(key, 0.0) + usage[key]
+    total['max_rss'] = max(total.get('max_rss') or 0, usage['max_rss'])
+
+def run_pandoc_text(text, output_format, input_format, extra_args=(), output_path=None):
+    """Run pandoc on text through temporary files, returning (output text, usage)
+
+    With an output_path pandoc writes there and the output text is None.
+    """
+    fd, input_path = tempfile.mkstemp(prefix='temp_', suffix='.txt')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    temp_output = None
+    if output_path is None:
+        fd, temp_output = tempfile.mkstemp(prefix='temp_', suffix='.' + output_format)
+        os.close(fd)
+    try:
+        usage = run_pandoc(input_path, output_path or temp_output, output_format, extra_args, input_format)
+        if temp_output is None:
+            return None, usage
+        with open(temp_output, 'r', encoding='utf-8') as f:
+            return f.read(), usage
+    finally:
+        for path in (input_path, temp_output):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+def parse_markdown(content, input_format='markdown', usage=None):
+    """Parse markdown to pandoc's JSON AST, adding the pandoc process's resource usage to usage"""
+    # Chunks carry definitions they do not use, which pandoc would warn about
+    output, process_usage = run_pandoc_text(content, 'json', input_format, ['--quiet'])
+    if usage is not None:
+        add_usage(usage, process_usage)
+    return json.loads(output)
+
+def parse_split_markdown(content, max_chunks, max_workers=None, usage=None):
+    """Parse markdown to pandoc's JSON AST in parallel chunks, returning (document, chunk count)
+
+    If a usage dict is given the resource usage of the pandoc processes is added to it.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    chunks = split_markdown_at_headings(content, max_chunks)
+    if len(chunks) == 1:
+        return parse_markdown(content, usage=usage), 1
+
+    # Each chunk is parsed to pandoc's JSON AST by its own pandoc process
+    chunk_usages = [{} for _ in chunks]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        documents = list(executor.map(lambda chunk, chunk_usage: parse_markdown(chunk, CHUNK_FORMAT, chunk_usage),
+                                      chunks, chunk_usages))
+    if usage is not None:
+        for chunk_usage in chunk_usages:
+            add_usage(usage, chunk_usage or None)
+
+    # Concatenate all blocks; later metadata blocks override earlier ones as in pandoc
+    merged = documents[0]
+    for document in documents[1:]:
+        merged['blocks'].extend(document['blocks'])
+        merged['meta'].update(document['meta'])
+    assign_identifiers(merged)
+    return merged, len(chunks)
+
+def check_split(content, max_chunks=None):
+    """Parse markdown both split and whole, returning (chunk count, identical)
+
+    By default the content is split at every boundary, the hardest case.
+    """
+    split, count = parse_split_markdown(content, max_chunks or len(content))
+    unsplit = parse_markdown(content)
+    return count, split['blocks'] == unsplit['blocks'] and split['meta'] == unsplit['meta']
+
+def convert_split_content(content, output_path, output_format, max_workers=None, verify=False, resources=None):
+    """Convert markdown content by parsing heading-delimited chunks in parallel
+
+    With verify the merged AST is also checked against an unsplit parse, and
+    the unsplit one is used if they differ. Returns the resource usage of all
+    pandoc processes like run_pandoc: their summed CPU times, the largest peak
+    memory of any of them, and the wall time spent waiting for them as
+    'pandoc_time'.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    usage = {}
+    start = time.perf_counter()
+    merged, count = parse_split_markdown(content, max_workers, max_workers, usage)
+
+    if verify and count > 1:
+        unsplit = parse_markdown(content, usage=usage)
+        if unsplit['blocks'] != merged['blocks'] or unsplit['meta'] != merged['meta']:
+            merged = unsplit
+    parse_time = time.perf_counter() - start
+
+    # Images are only read when rendering, so the resource path is needed there
+    extra_args = []
+    if resources is not None:
+        extra_args.append(f'--resource-path=.{os.pathsep}{resources.directory}')
+    _, render_usage = run_pandoc_text(json.dumps(merged), output_format, 'json', extra_args, output_path)
+    add_usage(usage, render_usage)
+    if not usage:
+        # Resource usage cannot be measured on this platform
+        return None
+    usage['pandoc_time'] = parse_time + render_usage['pandoc_time']
+    return usage
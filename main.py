@@ -1,9 +1,21 @@
 import os
 import sys
+import tempfile
 import platform
 from tkinter import Tk, Button, messagebox
 from convertor_gui import ConverterGUI
 from convertor_core import convert_file, convert_folder, combine_files, preprocess_markdown_lists
+from convertor_engines import compare_engines
+from convertor_archive import is_archive
+from convertor_profile import ConversionProfiler
+from convertor_resources import ResourceCache
+from convertor_input import benchmark_input, read_markdown
+from convertor_split import check_split
+
+# Documents checked by --check-split when no files are given
+SPLIT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "split")
+# Documents converted by --compare-engines when no files are given
+HTML_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "html")
 
 def show_splash_screen():
     """Show a splash screen while loading"""
@@ -75,28 +87,118 @@ def show_splash_screen():
     
     return
 
+def pop_option(args, name, default=None):
+    """Remove an option and its value from the argument list and return the value"""
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            value = args[index + 1]
+            del args[index:index + 2]
+            return value
+        del args[index]
+    return default
+
 def main():
-    if len(sys.argv) > 1:
+    args = sys.argv[1:]
+    engine = pop_option(args, "--engine", "pandoc")
+    max_workers = pop_option(args, "--max-workers")
+    memory_budget = pop_option(args, "--memory-budget")
+    max_workers = int(max_workers) if max_workers else None
+    memory_budget = int(memory_budget) * 1024 * 1024 if memory_budget else None  # Given in MB
+    profile_path = pop_option(args, "--profile")
+    profiler = ConversionProfiler() if profile_path else None
+    if profiler:
+        # Profiles cannot overlap, so profiled conversions run one at a time
+        max_workers = 1
+    resource_cache_dir = pop_option(args, "--resource-cache")
+    encodings = pop_option(args, "--encodings")
+    encodings = encodings.split(",") if encodings else None
+    
+    if len(args) > 0:
         # Command line mode
-        if sys.argv[1] == "--combine" and len(sys.argv) > 3:
+        # Pandoc reads and embeds every image again for each document, so the
+        # cache only saves work for the server engine, which is sent each
+        # image once by content hash, or when asked for with a cache folder
+        resource_cache = None
+        if resource_cache_dir or engine == "server":
+            resource_cache = ResourceCache(resource_cache_dir)
+        
+        if args[0] == "--compare-engines":
+            # Check HTML parity and per-file latency of two engines, by default
+            # pandoc against the in-process engine on the documents in corpus/html
+            engine_names = pop_option(args, "--engines", "pandoc,markdown").split(",")
+            output_folder = pop_option(args, "--output")
+            # Without --output a last argument that is not a markdown file is the output folder
+            if output_folder is None and len(args) > 1 and not args[-1].lower().endswith(('.md', '.markdown')):
+                output_folder = args.pop()
+            if output_folder is None:
+                output_folder = tempfile.mkdtemp(prefix="engine-compare-")
+            input_paths = args[1:] or [os.path.join(HTML_CORPUS, name) for name in sorted(os.listdir(HTML_CORPUS))]
+            results = compare_engines(input_paths, output_folder, engine_names)
+            
+            for name, identical, timings, skipped in results:
+                status = {True: "same", False: "DIFFERENT", None: "not compared"}[identical]
+                times = ", ".join(f"{engine_name} {seconds * 1000:.1f} ms" for engine_name, seconds in timings.items())
+                if skipped:
+                    times += " (" + ", ".join(f"{engine_name} {reason}" for engine_name, reason in skipped.items()) + ")"
+                print(f"{name}: {status}, {times}")
+            compared = [r for r in results if r[1] is not None]
+            if compared:
+                matching = sum(1 for r in compared if r[1])
+                averages = []
+                for engine_name in engine_names:
+                    times = [r[2][engine_name] for r in compared if engine_name in r[2]]
+                    if times:
+                        averages.append(f"{engine_name} {sum(times) / len(times) * 1000:.1f} ms")
+                averages = ", ".join(averages)
+                print(f"{matching}/{len(compared)} identical, average per file: {averages}")
+            else:
+                print("No file was converted by more than one engine")
+        elif args[0] == "--check-split":
+            # Check that documents split at every top-level heading parse like the whole document
+            paths = args[1:] or [os.path.join(SPLIT_CORPUS, name) for name in sorted(os.listdir(SPLIT_CORPUS))]
+            matching = 0
+            for path in paths:
+                chunk_count, identical = check_split(read_markdown(path, encodings))
+                matching += identical
+                print(f"{os.path.basename(path)}: {chunk_count} chunks, {'same' if identical else 'DIFFERENT'}")
+            print(f"{matching}/{len(paths)} identical to the unsplit parse")
+        elif args[0] == "--benchmark-input" and len(args) > 1:
+            # Compare a plain text-mode read with the memory-mapped, streaming input layer
+            plain_time, streamed_time = benchmark_input(args[1:])
+            size = sum(os.path.getsize(path) for path in args[1:])
+            print(f"Read {len(args) - 1} files ({size / (1024 * 1024):.1f} MB): "
+                  f"plain {plain_time * 1000:.1f} ms, streamed {streamed_time * 1000:.1f} ms")
+        elif args[0] == "--combine" and len(args) > 2:
             # Combine multiple files
-            input_files = sys.argv[2:-1]  # All arguments except the last one (output file)
-            output_path = sys.argv[-1]
+            input_files = args[1:-1]  # All arguments except the last one (output file)
+            output_path = args[-1]
             output_format = os.path.splitext(output_path)[1][1:]  # Get extension without dot
             
             print(f"Combining {len(input_files)} files into {output_path}")
-            success, result = combine_files(input_files, output_path, output_format)
+            if profiler:
+                success, result = profiler.run(output_path, combine_files, input_files, output_path,
+                                               output_format, engine=engine, resource_cache=resource_cache,
+                                               encodings=encodings)
+            else:
+                success, result = combine_files(input_files, output_path, output_format, engine=engine,
+                                                resource_cache=resource_cache, encodings=encodings)
             
             if success:
                 print(f"Successfully combined files into {result}")
             else:
                 print(f"Error: {result}")
-        elif os.path.isdir(sys.argv[1]):
-            # Convert all markdown files in the folder
-            output_folder = sys.argv[2] if len(sys.argv) > 2 else None
-            output_format = sys.argv[3] if len(sys.argv) > 3 else 'docx'
+        elif os.path.isdir(args[0]) or is_archive(args[0]):
+            # Convert all markdown files in the folder or archive
+            output_folder = args[1] if len(args) > 1 else None
+            output_format = args[2] if len(args) > 2 else 'docx'
             
-            success_count, error_count, error_files = convert_folder(sys.argv[1], output_folder, output_format)
+            success_count, error_count, error_files = convert_folder(args[0], output_folder, output_format,
+                                                                     engine=engine, max_workers=max_workers,
+                                                                     memory_budget=memory_budget,
+                                                                     profiler=profiler,
+                                                                     resource_cache=resource_cache,
+                                                                     encodings=encodings)
             
             print(f"Converted {success_count} files to {output_format.upper()} format")
             if error_count > 0:
@@ -105,15 +207,32 @@ def main():
                     print(f"- {name}: {err}")
         else:
             # Convert a single file
-            output_path = sys.argv[2] if len(sys.argv) > 2 else None
+            output_path = args[1] if len(args) > 1 else None
             output_format = os.path.splitext(output_path)[1][1:] if output_path else 'docx'
             
-            success, result = convert_file(sys.argv[1], output_path, output_format)
+            if profiler:
+                success, result = profiler.run(args[0], convert_file, args[0], output_path, output_format,
+                                               engine=engine, resource_cache=resource_cache, encodings=encodings)
+            else:
+                success, result = convert_file(args[0], output_path, output_format, engine=engine,
+                                               resource_cache=resource_cache, encodings=encodings)
             
             if success:
                 print(f"Successfully converted to {result}")
             else:
                 print(f"Error: {result}")
+        
+        if resource_cache is not None:
+            if resource_cache.hits or resource_cache.misses:
+                print(resource_cache.summary())
+            resource_cache.close()
+        
+        if profiler:
+            # Python profile for pstats/snakeviz, plus the per-file breakdown
+            profiler.dump(profile_path)
+            print()
+            print(profiler.report())
+            print(f"\nPython profile written to {profile_path}")
     else:
         # GUI mode
         # Show splash screen